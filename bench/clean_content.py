@@ -0,0 +1,94 @@
+"""Times Message.clean_content over synthetic chat.
+
+    python bench/clean_content.py [--messages 20000] [--old]
+
+The corpora are plain chat, chat where a quarter of the lines mention
+someone, and mention heavy lines such as role pings and link dumps. --old
+times the renderer that compiled two patterns for every message instead.
+"""
+import argparse
+import random
+import re
+import time
+
+import synthetic
+import discord
+
+WORDS = (u'the a to and is it that this for you on in of with just lol what was so but have be not '
+         u'are think like do get can know if no yeah ok when one all out how about why now well '
+         u'deploy build broken works fixed again tomorrow meeting anyone here merge branch test').split()
+
+
+def corpus(rng, server, lines, mentions):
+    """lines chat lines, mentions gives how many mentions each gets."""
+    channels = [channel.id for channel in server.channels]
+    roles = [role.id for role in server.roles[1:]]
+    members = [member.id for member in server.members]
+    kinds = [lambda: u'<@{}>'.format(rng.choice(members)), lambda: u'<@!{}>'.format(rng.choice(members)),
+             lambda: u'<@&{}>'.format(rng.choice(roles)), lambda: u'<#{}>'.format(rng.choice(channels)),
+             lambda: u'<@{}>'.format(rng.randint(1, 10 ** 17)), lambda: rng.choice([u'@everyone', u'@here'])]
+    payloads = []
+    for i in range(lines):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(2, 25))]
+        for _ in range(mentions()):
+            words.insert(rng.randrange(len(words) + 1), rng.choice(kinds)())
+        content = u' '.join(words)
+        ids = re.findall(r'<@!?([0-9]+)>', content)
+        payloads.append({'id': str(i), 'content': content, 'author': synthetic.user(int(members[0])),
+                         'mentions': [{'id': user_id} for user_id in ids],
+                         'mention_roles': re.findall(r'<@&([0-9]+)>', content)})
+    return payloads
+
+
+def old_clean_content(message):
+    # one compiled alternation of everything mentioned, then another for
+    # @everyone and @here
+    transformations = dict((re.escape(u'<#{}>'.format(c.id)), u'#' + c.name) for c in message.channel_mentions)
+    transformations.update((re.escape(u'<@{}>'.format(m.id)), u'@' + m.display_name) for m in message.mentions)
+    transformations.update((re.escape(u'<@!{}>'.format(m.id)), u'@' + m.display_name) for m in message.mentions)
+    transformations.update((re.escape(u'<@&{}>'.format(r.id)), u'@' + r.name) for r in message.role_mentions)
+    result = message.content
+    if transformations:
+        pattern = re.compile(u'|'.join(transformations))
+        result = pattern.sub(lambda match: transformations.get(re.escape(match.group(0)), u''), result)
+    everyone = {u'@everyone': u'@\u200beveryone', u'@here': u'@\u200bhere'}
+    pattern = re.compile(u'|'.join(everyone))
+    return pattern.sub(lambda match: everyone[match.group(0)], result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--old', action='store_true')
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    server = discord.Server(**synthetic.guild(members=500, roles=30, channels=30))
+    channel = server.get_channel(server.channels[0].id)
+    corpora = [
+        ('plain', lambda: 0),
+        ('a quarter mention', lambda: rng.randint(1, 2) if rng.random() < 0.25 else 0),
+        ('mention heavy', lambda: rng.randint(3, 12)),
+    ]
+    for name, mentions in corpora:
+        payloads = corpus(rng, server, args.messages, mentions)
+        messages = [discord.Message(channel=channel, **payload) for payload in payloads]
+        times = []
+        for _ in range(args.repeat):
+            for message in messages:
+                # clean_content is cached on the message after the first time
+                message._update(channel=channel, **payloads[int(message.id)])
+            start = time.time()
+            if args.old:
+                for message in messages:
+                    old_clean_content(message)
+            else:
+                for message in messages:
+                    message.clean_content
+            times.append(time.time() - start)
+        print('{:<20} {} messages: best {:.3f}s of {}'.format(name, len(messages), min(times), args.repeat))
+
+
+if __name__ == '__main__':
+    main()
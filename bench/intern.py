@@ -0,0 +1,58 @@
+"""Memory of guild members when the same accounts share many guilds, with
+and without interning their User records.
+
+    python bench/intern.py [--guilds 50] [--members 5000] [--users 20000]
+
+Every guild draws its members from the same users, so with the defaults
+each user is in about a dozen guilds. --no-intern builds a User for every
+member, as if they weren't shared. Each way runs in its own process.
+"""
+import argparse
+import gc
+import os
+import random
+import subprocess
+import sys
+
+import synthetic
+import discord
+from discord.user import User
+
+
+def measure(args, intern):
+    if not intern:
+        User._intern = classmethod(lambda cls, data: cls(**data))
+    rng = random.Random(3)
+    user_ids = range(1000, 1000 + args.users)
+    payloads = [synthetic.guild(guild_id=i + 1, member_ids=rng.sample(user_ids, args.members), channels=5)
+                for i in range(args.guilds)]
+    gc.collect()
+    before = synthetic.peak_rss()
+    servers = [discord.Server(**payload) for payload in payloads]
+    gc.collect()
+    grown = synthetic.peak_rss() - before
+    members = [member for server in servers for member in server.members]
+    users = len(set(id(member._user) for member in members))
+    print('{:<10} {} members, {} User records, {} ({:.0f} bytes a member)'.format(
+        'interned' if intern else 'not', len(members), users, synthetic.megabytes(grown),
+        float(grown) / len(members)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--guilds', type=int, default=50)
+    parser.add_argument('--members', type=int, default=5000)
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--no-intern', action='store_true')
+    parser.add_argument('--measure', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        return measure(args, not args.no_intern)
+    for flag in ([], ['--no-intern']):
+        subprocess.check_call([sys.executable, os.path.abspath(__file__), '--measure', '--guilds', str(args.guilds),
+                               '--members', str(args.members), '--users', str(args.users)] + flag)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""Bytes taken by each Member, Role and Channel of a guild.
+
+    python bench/models_memory.py [--count 100000]
+
+Each model is measured in its own process: a guild with count of them is
+built and the growth in peak RSS divided by count. That includes whatever
+the guild keeps for them, such as its id maps and a member's User.
+"""
+import argparse
+import gc
+import os
+import subprocess
+import sys
+
+import synthetic
+import discord
+
+GUILDS = {
+    'Member': lambda count: synthetic.guild(members=count, roles=20, channels=1),
+    'Role': lambda count: synthetic.guild(members=1, roles=count, roles_each=1, channels=1),
+    'Channel': lambda count: synthetic.guild(members=1, roles=1, roles_each=1, channels=count),
+}
+
+
+def measure(model, count):
+    payload = GUILDS[model](count)
+    gc.collect()
+    before = synthetic.peak_rss()
+    server = discord.Server(**payload)
+    gc.collect()
+    grown = synthetic.peak_rss() - before
+    sample = {'Member': server.members, 'Role': server.roles, 'Channel': server.channels}[model]
+    sample = next(iter(sample))
+    print('{:<8} {:>6.0f} bytes each, {:>4} for the object itself{}'.format(
+        model, float(grown) / count, sys.getsizeof(sample),
+        ', which has a __dict__' if hasattr(sample, '__dict__') else ''))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--measure', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        return measure(args.measure, args.count)
+    for model in ('Member', 'Role', 'Channel'):
+        subprocess.check_call([sys.executable, os.path.abspath(__file__), '--measure', model, '--count', str(args.count)])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Times building a large guild from its READY payload.
+
+    python bench/ready.py [--members 20000] [--roles 200] [--linear-roles]
+
+--linear-roles resolves member roles by walking the role list, as it was
+done before Server kept its role id map, to show the difference.
+"""
+import argparse
+import copy
+import gc
+import time
+
+import synthetic
+import discord
+from discord import utils
+from discord.server import Server
+
+
+class LinearRoles(dict):
+    # role lookups the old way, a walk over the role list each time
+    def __init__(self, roles):
+        dict.__init__(self)
+        self.roles = roles
+
+    def get(self, role_id, default=None):
+        return utils.find(lambda role: role.id == role_id, self.roles)
+
+
+def linear_roles():
+    add_members = Server._add_members
+    def _add_members(self, members):
+        roles, self._roles = self._roles, LinearRoles(self.roles)
+        try:
+            add_members(self, members)
+        finally:
+            self._roles = roles
+    Server._add_members = _add_members
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--members', type=int, default=20000)
+    parser.add_argument('--roles', type=int, default=200)
+    parser.add_argument('--roles-each', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--linear-roles', action='store_true')
+    args = parser.parse_args()
+
+    if args.linear_roles:
+        linear_roles()
+    payload = synthetic.guild(members=args.members, roles=args.roles, roles_each=args.roles_each)
+    times = []
+    for _ in range(args.repeat):
+        data = copy.deepcopy(payload)
+        gc.collect()
+        start = time.time()
+        server = discord.Server(**data)
+        times.append(time.time() - start)
+        del server, data
+    print('{} members, {} roles ({} each){}: best {:.3f}s of {}'.format(
+        args.members, args.roles, args.roles_each, ', linear role lookups' if args.linear_roles else '',
+        min(times), args.repeat))
+
+
+if __name__ == '__main__':
+    main()
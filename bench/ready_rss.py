@@ -0,0 +1,79 @@
+"""Peak memory of decoding a big READY and building its guilds, with
+json.loads against gateway.parse_message, which decodes the guilds one at a
+time.
+
+    python bench/ready_rss.py [--guilds 100] [--members 5000]
+
+Each way runs in its own process, which reads the READY text from a file
+first so that both start from the same place.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import synthetic
+import discord
+import gateway
+
+
+def ready(path, guilds, members):
+    # written a guild at a time, the whole payload would take more memory
+    # than what's being measured
+    with open(path, 'w') as f:
+        f.write('{"t":"READY","s":1,"op":0,"d":{"v":6,"session_id":"abc","user":')
+        f.write(json.dumps(synthetic.user(1)))
+        f.write(',"guilds":[')
+        for i in range(guilds):
+            if i:
+                f.write(',')
+            f.write(json.dumps(synthetic.guild(guild_id=i + 1, members=members)))
+        f.write('],"private_channels":[],"_trace":["gateway-1"]}}')
+
+
+def measure(path, mode):
+    with open(path) as f:
+        text = f.read()
+    before = synthetic.peak_rss()
+    start = time.time()
+    decode = json.loads if mode == 'json.loads' else gateway.parse_message
+    msg = decode(text)
+    del text
+    servers = []
+    for guild in msg['d']['guilds']:
+        servers.append(discord.Server(**guild))
+    del msg
+    print('{:<20} {:>10} peak, {:>10} over the READY text, {:.1f}s'.format(
+        mode, synthetic.megabytes(synthetic.peak_rss()), synthetic.megabytes(synthetic.peak_rss() - before),
+        time.time() - start))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--guilds', type=int, default=100)
+    parser.add_argument('--members', type=int, default=5000)
+    parser.add_argument('--measure', help=argparse.SUPPRESS)
+    parser.add_argument('--ready', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        return measure(args.ready, args.measure)
+
+    fd, path = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    try:
+        ready(path, args.guilds, args.members)
+        print('READY with {} guilds of {} members: {}'.format(
+            args.guilds, args.members, synthetic.megabytes(os.path.getsize(path))))
+        sys.stdout.flush()
+        for mode in ('json.loads', 'parse_message'):
+            subprocess.check_call([sys.executable, os.path.abspath(__file__), '--measure', mode, '--ready', path])
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
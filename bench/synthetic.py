@@ -0,0 +1,58 @@
+"""Synthetic discord payloads for the benchmarks in this directory."""
+import os
+import random
+import resource
+import sys
+
+# drawbridge's modules import each other as top level modules
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'drawbridge'))
+
+
+def user(user_id, name=None):
+    return {'id': str(user_id), 'username': name or u'user {}'.format(user_id),
+            'discriminator': '{:04d}'.format(user_id % 10000), 'avatar': 'a' * 32}
+
+
+def guild(guild_id=1, members=1000, roles=20, channels=20, roles_each=3, member_ids=None, seed=0):
+    """A guild payload as it is in READY or GUILD_CREATE. Members get
+    roles_each random roles, every other channel is hidden from @everyone
+    and opened to one role. member_ids picks the users, otherwise they're
+    numbered after the guild so that no two guilds share any."""
+    rng = random.Random(seed or guild_id)
+    gid = str(guild_id)
+    role_ids = [str(guild_id * 1000 + i) for i in range(roles)]
+    if member_ids is None:
+        member_ids = range(guild_id * 1000000, guild_id * 1000000 + members)
+    payload = {
+        'id': gid, 'name': u'guild {}'.format(guild_id), 'owner_id': str(member_ids[0]),
+        'member_count': len(member_ids), 'large': len(member_ids) > 250,
+        'roles': [{'id': gid, 'name': u'@everyone', 'permissions': 0x400, 'position': 0}] +
+                 [{'id': role_id, 'name': u'role {}'.format(i), 'permissions': 0, 'position': i + 1, 'color': i}
+                  for i, role_id in enumerate(role_ids)],
+        'members': [{'user': user(user_id), 'roles': rng.sample(role_ids, min(roles_each, roles)),
+                     'joined_at': '2016-01-01T00:00:00.123000+00:00', 'deaf': False, 'mute': False}
+                    for user_id in member_ids],
+        'presences': [{'user': {'id': str(user_id)}, 'status': 'online', 'game': None}
+                      for user_id in member_ids[::4]],
+        'channels': [],
+    }
+    for i in range(channels):
+        overwrites = []
+        if i % 2:
+            overwrites = [{'id': gid, 'type': 'role', 'allow': 0, 'deny': 0x400},
+                          {'id': rng.choice(role_ids), 'type': 'role', 'allow': 0x400, 'deny': 0}]
+        payload['channels'].append({'id': '{}{:03d}'.format(gid, i), 'name': u'channel {}'.format(i),
+                                    'type': 'text', 'position': i, 'topic': None,
+                                    'permission_overwrites': overwrites})
+    return payload
+
+
+def peak_rss():
+    """Peak resident set size of this process so far, in bytes."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on OS X
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def megabytes(n):
+    return '{:.1f} MB'.format(n / 1048576.0)
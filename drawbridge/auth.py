@@ -2,7 +2,7 @@ from twisted.internet import defer
 from twisted.python import failure
 from twisted.cred import error, credentials, checkers, portal
 
-import chord
+import rest
 
 from realm import DiscordWordsRealm
 from zope.interface import implementer
@@ -68,7 +68,7 @@ class DiscordAuthenticator(object):
         def clear_token(*a, **kw):
             self.token = None
 
-        d = chord.invalidate_token(self.token)
+        d = rest.invalidate_token(self.token)
         d.addCallback(clear_token)
         return d
 
@@ -78,7 +78,7 @@ class DiscordAuthenticator(object):
             key = password.split(':', 1)
         d = self.test_creds(*key)
         d.addCallback(self.set_token)
-        d.addCallback(chord.get_user_for_token)
+        d.addCallback(rest.get_user_for_token)
         d.addCallback(self.set_meta)
         return d
 
@@ -95,11 +95,11 @@ class DiscordAuthenticator(object):
 
         if len(args)==1:
             (token,) = args
-            return chord.check_token(token)
+            return rest.check_token(token)
         if len(args)==2:
             if email == 'token':
                 (_,token) = args
-                return chord.check_token(token)
+                return rest.check_token(token)
             else:
                 (_, password) = args
-                return chord.get_token(email, password)
+                return rest.get_token(email, password)
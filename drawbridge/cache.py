@@ -0,0 +1,48 @@
+class GuildCache(object):
+    """Parsed guilds shared by every session in the process.
+
+    A guild is only parsed once no matter how many connected users can see
+    it. Sessions take a reference when they start using a guild and hand it
+    back when they are done with it, the guild is dropped once nobody holds
+    it anymore. Everything per-user about a guild (our own member, our
+    permissions) is looked up by member id on the shared models.
+    """
+    def __init__(self):
+        self._guilds = {}
+        self._refs = {}
+
+    def __len__(self):
+        return len(self._guilds)
+
+    def __contains__(self, guild_id):
+        return guild_id in self._guilds
+
+    def acquire(self, guild_id):
+        """Returns the cached guild and takes a reference to it, or None if
+        it isn't cached yet."""
+        guild = self._guilds.get(guild_id)
+        if guild is not None:
+            self._refs[guild_id] += 1
+        return guild
+
+    def add(self, guild):
+        """Caches a freshly parsed guild and takes a reference to it. If
+        someone else got there first, their copy is referenced and returned
+        instead."""
+        cached = self.acquire(guild.id)
+        if cached is not None:
+            return cached
+        self._guilds[guild.id] = guild
+        self._refs[guild.id] = 1
+        return guild
+
+    def release(self, guild):
+        refs = self._refs.get(guild.id, 0) - 1
+        if refs > 0:
+            self._refs[guild.id] = refs
+        else:
+            self._refs.pop(guild.id, None)
+            self._guilds.pop(guild.id, None)
+
+
+shared_guilds = GuildCache()
@@ -83,7 +83,7 @@ class Channel(Hashable):
 
     __slots__ = [ 'voice_members', 'name', 'id', 'server', 'topic', 'position',
                   'is_private', 'type', 'bitrate', 'user_limit',
-                  '_permission_overwrites' ]
+                  '_permission_overwrites', '_permissions' ]
 
     def __init__(self, **kwargs):
         self._update(**kwargs)
@@ -108,6 +108,7 @@ class Channel(Hashable):
             pass
 
         self._permission_overwrites = []
+        self._invalidate_permissions()
         everyone_index = 0
         everyone_id = self.server.default_role.id
 
@@ -137,11 +138,13 @@ class Channel(Hashable):
         their default values in the :attr:`Server.roles` attribute."""
         ret = []
         for overwrite in filter(lambda o: o.type == 'role', self._permission_overwrites):
-            role = utils.get(self.server.roles, id=overwrite.id)
+            role = self.server.get_role(overwrite.id)
             if role is None:
                 continue
 
+            # the copy must not share its permissions with the server's role
             role = copy.copy(role)
+            role.permissions = Permissions(role.permissions.value)
             role.permissions.handle_overwrite(overwrite.allow, overwrite.deny)
             ret.append(role)
         return ret
@@ -149,11 +152,28 @@ class Channel(Hashable):
     @property
     def members(self):
         """Returns a generator of members with access to this channel"""
-        def filter_members(channel, members):
-            for member in members:
-                if channel.permissions_for(member).read_messages:
+        # The server works out which role sets can read this channel in
+        # bulk. Only the owner and members with their own overwrite here
+        # can differ from the rest of their role set.
+        special = set(o.id for o in self._permission_overwrites if o.type == 'member')
+        special.add(self.server.owner_id)
+
+        def filter_members(channel, readers):
+            for members in readers:
+                for member in members:
+                    if member.id not in special:
+                        yield member
+
+            for member_id in special:
+                member = channel.server.get_member(member_id)
+                if member is not None and channel.permissions_for(member).read_messages:
                     yield member
-        return filter_members(self, self.server.members)
+        return filter_members(self, self.server._readers_of(self))
+
+    @property
+    def irc_name(self):
+        """str : The channel name as it is exposed to IRC clients, without the leading ``#``."""
+        return self.name.replace(' ', '_')
 
     @property
     def is_default(self):
@@ -220,6 +240,25 @@ class Channel(Hashable):
             The resolved permissions for the member.
         """
 
+        # Resolved values are cached per member until the server tells us
+        # the roles, overwrites or member roles involved have changed.
+        value = self._permissions.get(member.id)
+        if value is None:
+            value = self._resolve_permissions(member)
+            self._permissions[member.id] = value
+            self.server._permission_ids.add(member.id)
+        return Permissions(value)
+
+    def _invalidate_permissions(self, member=None):
+        """Drops the cached permissions for member, or for everyone if no
+        member is given."""
+        if member is None:
+            self._permissions = {}
+        else:
+            self._permissions.pop(member.id, None)
+        self.server._readers.pop(self.id, None)
+
+    def _resolve_permissions(self, member):
         # The current cases can be explained as:
         # Server owner get all permissions -- no questions asked. Otherwise...
         # The @everyone role gets the first application.
@@ -236,8 +275,8 @@ class Channel(Hashable):
         # The operation first takes into consideration the denied
         # and then the allowed.
 
-        if member.id == self.server.owner.id:
-            return Permissions.all()
+        if member.id == self.server.owner_id:
+            return Permissions.all().value
 
         default = self.server.default_role
         base = Permissions(default.permissions.value)
@@ -246,27 +285,34 @@ class Channel(Hashable):
         for role in member.roles:
             base.value |= role.permissions.value
 
+        member_role_ids = set(map(lambda r: r.id, member.roles))
+        return self._apply_overwrites(base.value, member_role_ids, member.id)
+
+    def _apply_overwrites(self, value, role_ids, member_id=None):
+        # Takes the raw value of the server roles and applies this channel's
+        # overwrites for role_ids and member_id to it. Split out so that
+        # Server can resolve a whole set of roles at once.
+        base = Permissions(value)
+
         # Server-wide Administrator -> True for everything
         # Bypass all channel-specific overrides
         if base.administrator:
-            return Permissions.all()
-
-        member_role_ids = set(map(lambda r: r.id, member.roles))
+            return Permissions.all().value
 
         # Apply channel specific role permission overwrites
         for overwrite in self._permission_overwrites:
-            if overwrite.type == 'role' and overwrite.id in member_role_ids:
+            if overwrite.type == 'role' and overwrite.id in role_ids:
                 base.handle_overwrite(allow=overwrite.allow, deny=overwrite.deny)
 
         # Apply member specific permission overwrites
         for overwrite in self._permission_overwrites:
-            if overwrite.type == 'member' and overwrite.id == member.id:
+            if overwrite.type == 'member' and overwrite.id == member_id:
                 base.handle_overwrite(allow=overwrite.allow, deny=overwrite.deny)
 
         if self.is_default:
             base.read_messages = True
 
-        return base
+        return base.value
 
 class PrivateChannel(Hashable):
     """Represents a Discord private channel.
@@ -24,7 +24,7 @@ FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 DEALINGS IN THE SOFTWARE.
 """
 
-class Colour:
+class Colour(object):
     """Represents a Discord role colour. This class is similar
     to an (red, green, blue) tuple.
 
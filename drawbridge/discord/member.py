@@ -24,17 +24,19 @@ FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 DEALINGS IN THE SOFTWARE.
 """
 
-from .user import User
+from .user import User, _BaseUser
 from .game import Game
 from . import utils
 from .enums import Status
 from .colour import Colour
 
-class Member(User):
+class Member(_BaseUser):
     """Represents a Discord member to a :class:`Server`.
 
-    This is a subclass of :class:`User` that extends more functionality
-    that server members have such as roles and permissions.
+    This extends a :class:`User` with the functionality that server members
+    have such as roles and permissions. The user attributes (``name``,
+    ``id``, ``discriminator``, ``avatar`` and ``bot``) are read from the
+    one :class:`User` shared by every server the user is in.
 
     Attributes
     ----------
@@ -68,15 +70,15 @@ class Member(User):
         The server specific nickname of the user.
     """
 
-    __slots__ = [ 'deaf', 'mute', 'self_mute', 'self_deaf', 'is_afk',
-                  'voice_channel', 'roles', 'joined_at', 'status', 'game',
+    __slots__ = [ '_user', 'deaf', 'mute', 'self_mute', 'self_deaf', 'is_afk',
+                  'voice_channel', 'roles', '_joined_at', '_raw_joined_at', 'status', 'game',
                   'server', 'nick' ]
 
     def __init__(self, **kwargs):
-        super(Member, self).__init__(**kwargs.get('user'))
+        self._user = User._intern(kwargs.get('user'))
         self.deaf = kwargs.get('deaf')
         self.mute = kwargs.get('mute')
-        self.joined_at = utils.parse_time(kwargs.get('joined_at'))
+        self._raw_joined_at = kwargs.get('joined_at')
         self.roles = kwargs.get('roles', [])
         self.status = Status.offline
         game = kwargs.get('game', {})
@@ -85,6 +87,26 @@ class Member(User):
         self.nick = kwargs.get('nick', None)
         self._update_voice_state(mute=self.mute, deaf=self.deaf)
 
+    @property
+    def name(self):
+        return self._user.name
+
+    @property
+    def id(self):
+        return self._user.id
+
+    @property
+    def discriminator(self):
+        return self._user.discriminator
+
+    @property
+    def avatar(self):
+        return self._user.avatar
+
+    @property
+    def bot(self):
+        return self._user.bot
+
     def _update_voice_state(self, **kwargs):
         self.self_mute = kwargs.get('self_mute', False)
         self.self_deaf = kwargs.get('self_deaf', False)
@@ -108,6 +130,10 @@ class Member(User):
                 if self.voice_channel is not None:
                     self.voice_channel.voice_members.append(self)
 
+    @utils.cached_slot_property('_joined_at')
+    def joined_at(self):
+        return utils.parse_time(self._raw_joined_at)
+
     @property
     def colour(self):
         """A property that returns a :class:`Colour` denoting the rendered colour
@@ -140,7 +166,7 @@ class Member(User):
         return '<@{}>'.format(self.id)
 
     def mentioned_in(self, message):
-        mentioned = super().mentioned_in(message)
+        mentioned = super(Member, self).mentioned_in(message)
         if mentioned:
             return True
 
@@ -29,7 +29,10 @@ from .user import User
 from .object import Object
 import re
 
-class Message:
+# <@id>, <@!id>, <@&id>, <#id>, @everyone and @here in a single pass
+_mentions = re.compile(r'<(@[!&]?|#)([0-9]+)>|@(everyone|here)')
+
+class Message(object):
     """Represents a message from Discord.
 
     There should be no need to create one of these manually.
@@ -92,7 +95,8 @@ class Message:
         A list of attachments given to a message.
     """
 
-    __slots__ = [ 'edited_timestamp', 'timestamp', 'tts', 'content', 'channel',
+    __slots__ = [ '_edited_timestamp', '_timestamp', '_raw_edited_timestamp',
+                  '_raw_timestamp', 'tts', 'content', 'channel',
                   'mention_everyone', 'embeds', 'id', 'mentions', 'author',
                   'channel_mentions', 'server', '_raw_mentions', 'attachments',
                   '_clean_content', '_raw_channel_mentions', 'nonce',
@@ -102,19 +106,13 @@ class Message:
         self._update(**kwargs)
 
     def _update(self, **data):
-        # at the moment, the timestamps seem to be naive so they have no time zone and operate on UTC time.
-        # we can use this to our advantage to use strptime instead of a complicated parsing routine.
-        # example timestamp: 2015-08-21T12:03:45.782000+00:00
-        # sometimes the .%f modifier is missing
-        self.edited_timestamp = utils.parse_time(data.get('edited_timestamp'))
-        self.timestamp = utils.parse_time(data.get('timestamp'))
         self.tts = data.get('tts')
         self.content = data.get('content')
         self.mention_everyone = data.get('mention_everyone')
         self.embeds = data.get('embeds')
         self.id = data.get('id')
         self.channel = data.get('channel')
-        self.author = User(**data.get('author', {}))
+        self.author = User._intern(data.get('author', {}))
         self.nonce = data.get('nonce')
         self.attachments = data.get('attachments')
         self._handle_upgrades(data.get('channel_id'))
@@ -128,6 +126,19 @@ class Message:
             except AttributeError:
                 pass
 
+        # at the moment, the timestamps seem to be naive so they have no time zone and operate on UTC time.
+        # hardly anything looks at them though, so they're only parsed on first access.
+        self._raw_edited_timestamp = data.get('edited_timestamp')
+        self._raw_timestamp = data.get('timestamp')
+
+    @utils.cached_slot_property('_edited_timestamp')
+    def edited_timestamp(self):
+        return utils.parse_time(self._raw_edited_timestamp)
+
+    @utils.cached_slot_property('_timestamp')
+    def timestamp(self):
+        return utils.parse_time(self._raw_timestamp)
+
     def _handle_mentions(self, mentions, role_mentions):
         self.mentions = []
         self.channel_mentions = []
@@ -149,7 +160,7 @@ class Message:
                     self.channel_mentions.append(channel)
 
             for role_id in role_mentions:
-                role = utils.get(self.server.roles, id=role_id)
+                role = self.server.get_role(role_id)
                 if role is not None:
                     self.role_mentions.append(role)
 
@@ -188,48 +199,32 @@ class Message:
         non-mentions.
         """
 
-        transformations = {
-            re.escape('<#{0.id}>'.format(channel)): '#' + channel.name
-            for channel in self.channel_mentions
-        }
-
-        mention_transforms = {
-            re.escape('<@{0.id}>'.format(member)): '@' + member.display_name
-            for member in self.mentions
-        }
-
-        # add the <@!user_id> cases as well..
-        second_mention_transforms = {
-            re.escape('<@!{0.id}>'.format(member)): '@' + member.display_name
-            for member in self.mentions
-        }
+        channels = {channel.id: channel for channel in self.channel_mentions}
+        members = {member.id: member for member in self.mentions}
+        roles = {role.id: role for role in self.role_mentions}
 
-        transformations.update(mention_transforms)
-        transformations.update(second_mention_transforms)
+        def repl(match):
+            kind, id, everyone = match.groups()
+            if everyone is not None:
+                return u'@\u200b' + everyone
 
-        if self.server is not None:
-            role_transforms = {
-                re.escape('<@&{0.id}>'.format(role)): '@' + role.name
-                for role in self.role_mentions
-            }
-            transformations.update(role_transforms)
-
-        def repl(obj):
-            return transformations.get(re.escape(obj.group(0)), '')
-
-        pattern = re.compile('|'.join(transformations.keys()))
-        result = pattern.sub(repl, self.content)
-
-        transformations = {
-            '@everyone': '@\u200beveryone',
-            '@here': '@\u200bhere'
-        }
+            if kind == '#':
+                channel = channels.get(id)
+                if channel is not None:
+                    return u'#' + channel.name
+            elif kind == '@&':
+                role = roles.get(id)
+                if role is not None:
+                    return u'@' + role.name
+            else:
+                member = members.get(id)
+                if member is not None:
+                    return u'@' + member.display_name
 
-        def repl2(obj):
-            return transformations.get(obj.group(0), '')
+            # not something discord resolved for us, leave it alone
+            return match.group(0)
 
-        pattern = re.compile('|'.join(transformations.keys()))
-        return pattern.sub(repl2, result)
+        return _mentions.sub(repl, self.content)
 
     def _handle_upgrades(self, channel_id):
         self.server = None
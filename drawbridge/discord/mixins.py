@@ -24,7 +24,7 @@ FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 DEALINGS IN THE SOFTWARE.
 """
 
-class EqualityComparable:
+class EqualityComparable(object):
     __slots__ = []
 
     def __eq__(self, other):
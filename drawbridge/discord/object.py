@@ -25,7 +25,7 @@ DEALINGS IN THE SOFTWARE.
 
 from .utils import snowflake_time
 
-class Object:
+class Object(object):
     """Represents a generic Discord object.
 
     The purpose of this class is to allow you to create 'miniature'
@@ -45,10 +45,12 @@ class Object:
         The ID of the object.
     """
 
+    __slots__ = [ 'id', 'is_private' ]
+
     def __init__(self, id):
         self.id = id
 
     @property
     def created_at(self):
         """Returns the snowflake's creation time in UTC."""
-        return utils.snowflake_time(self.id)
+        return snowflake_time(self.id)
@@ -24,7 +24,7 @@ FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 DEALINGS IN THE SOFTWARE.
 """
 
-class Permissions:
+class Permissions(object):
     """Wraps up the Discord permission value.
 
     Supported operations:
@@ -90,6 +90,8 @@ class Role(Hashable):
         self.managed = kwargs.get('managed', False)
         self.mentionable = kwargs.get('mentionable', False)
         self.color = self.colour
+        # permissions resolved against the old values are stale now
+        self.server._invalidate_permissions()
 
     @property
     def is_everyone(self):
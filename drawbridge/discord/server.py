@@ -29,6 +29,7 @@ from .role import Role
 from .member import Member
 from .game import Game
 from .channel import Channel
+from .permissions import Permissions
 from .enums import ServerRegion, Status
 from .mixins import Hashable
 import copy
@@ -54,9 +55,6 @@ class Server(Hashable):
     ----------
     name : str
         The server name.
-    me : :class:`Member`
-        Similar to :attr:`Client.user` except an instance of :class:`Member`.
-        This is essentially used to get the member version of yourself.
     roles
         A list of :class:`Role` that the server has available.
     region : :class:`ServerRegion`
@@ -86,16 +84,28 @@ class Server(Hashable):
         Indicates if the server is a 'large' server. A large server is defined as having
         more than ``large_threshold`` count members, which for this library is set to
         the maximum of 250.
+    lazy_members : bool
+        Indicates if only some of the members are kept loaded, see
+        :meth:`Server._limit_members`. :attr:`members` is then incomplete.
     """
 
     __slots__ = ['afk_timeout', 'afk_channel', '_members', '_channels', 'icon',
-                 'name', 'id', 'owner', 'unavailable', 'name', 'region',
+                 'name', 'id', 'owner', 'unavailable', 'region',
                  '_default_role', '_default_channel', 'roles', '_member_count',
-                 'large', 'owner_id' ]
+                 'large', 'owner_id', '_irc_channels', '_irc_names', '_roles',
+                 '_role_sets', '_readers', '_permission_ids', 'lazy_members' ]
 
     def __init__(self, **kwargs):
         self._channels = {}
+        self._irc_channels = {}
+        self._irc_names = {}
+        self._roles = {}
+        self._role_sets = None
+        self._readers = {}
+        self._permission_ids = set()
         self.owner = None
+        self.owner_id = None
+        self.lazy_members = False
         self._members = {}
         self._from_data(kwargs)
 
@@ -107,11 +117,29 @@ class Server(Hashable):
         """Returns a :class:`Channel` with the given ID. If not found, returns None."""
         return self._channels.get(channel_id)
 
+    def get_channel_by_irc_name(self, name):
+        """Returns the text :class:`Channel` routed to the given IRC channel
+        name (without the leading ``#``). If not found, returns None."""
+        return self._channels.get(self._irc_channels.get(name.lower()))
+
     def _add_channel(self, channel):
         self._channels[channel.id] = channel
+        # Re-adding a channel after it was renamed moves its route over to
+        # the new name, so this doubles as the rename hook.
+        self._unroute_channel(channel)
+        if str(channel.type) == 'text':
+            name = channel.irc_name.lower()
+            self._irc_channels[name] = channel.id
+            self._irc_names[channel.id] = name
 
     def _remove_channel(self, channel):
         self._channels.pop(channel.id, None)
+        self._unroute_channel(channel)
+
+    def _unroute_channel(self, channel):
+        name = self._irc_names.pop(channel.id, None)
+        if name is not None and self._irc_channels.get(name) == channel.id:
+            del self._irc_channels[name]
 
     @property
     def members(self):
@@ -121,11 +149,91 @@ class Server(Hashable):
         """Returns a :class:`Member` with the given ID. If not found, returns None."""
         return self._members.get(user_id)
 
+    def _limit_members(self, maxsize):
+        """Keeps at most maxsize members loaded, dropping the least recently
+        used ones. For large servers whose members get loaded on demand."""
+        members = utils.LRUDict(maxsize, on_evict=self._invalidate_permissions)
+        for member in self._members.values():
+            members[member.id] = member
+        self._members = members
+        self.lazy_members = True
+
+    def _pin_member(self, user_id):
+        """Never drop the member with this ID, e.g. ourselves."""
+        if self.lazy_members:
+            self._members.pinned.add(user_id)
+
     def _add_member(self, member):
+        self._store_member(member)
+        # re-adding is how an updated member gets back in, and its roles
+        # may have changed along the way.
+        self._invalidate_permissions(member)
+
+    def _store_member(self, member):
         self._members[member.id] = member
+        if member.id == self.owner_id:
+            self.owner = member
 
     def _remove_member(self, member):
         self._members.pop(member.id, None)
+        self._invalidate_permissions(member)
+
+    def _invalidate_permissions(self, member=None):
+        """Drops cached channel permissions for member, or for every member
+        if none is given. Needed whenever roles, overwrites or a member's
+        roles change."""
+        if member is None:
+            self._role_sets = None
+            self._readers = {}
+            self._permission_ids = set()
+            for channel in self.channels:
+                channel._invalidate_permissions()
+        else:
+            self._invalidate_members([member])
+
+    def _invalidate_members(self, members):
+        # Which role sets can read a channel changes with every member, but
+        # that's two resets. The channels only need visiting for members
+        # they cached permissions for, usually none of them.
+        self._role_sets = None
+        self._readers = {}
+        cached = [member.id for member in members if member.id in self._permission_ids]
+        if cached:
+            self._permission_ids.difference_update(cached)
+            for channel in self.channels:
+                for member_id in cached:
+                    channel._permissions.pop(member_id, None)
+
+    def _readers_of(self, channel):
+        """Returns the lists of members whose roles let them read channel,
+        not accounting for the owner and member overwrites."""
+        readers = self._readers.get(channel.id)
+        if readers is None:
+            readers = []
+            for role_ids, (value, members) in self._resolve_role_sets().items():
+                if Permissions(channel._apply_overwrites(value, role_ids)).read_messages:
+                    readers.append(members)
+            self._readers[channel.id] = readers
+        return readers
+
+    def _resolve_role_sets(self):
+        # Members holding the same roles get the same permissions apart from
+        # member overwrites, so group them by role set and OR their role
+        # masks together once per group instead of once per member.
+        if self._role_sets is None:
+            everyone = self.default_role.permissions.value
+            role_sets = {}
+            for member in self.members:
+                role_ids = frozenset(role.id for role in member.roles)
+                role_set = role_sets.get(role_ids)
+                if role_set is None:
+                    value = everyone
+                    for role in member.roles:
+                        value |= role.permissions.value
+                    role_set = role_sets[role_ids] = (value, [])
+                role_set[1].append(member)
+            self._role_sets = role_sets
+        return self._role_sets
 
     def __str__(self):
         return self.name
@@ -140,6 +248,10 @@ class Server(Hashable):
             member._update_voice_state(voice_channel=channel, **data)
         return before, member
 
+    def get_role(self, role_id):
+        """Returns a :class:`Role` with the given ID. If not found, returns None."""
+        return self._roles.get(role_id)
+
     def _add_role(self, role):
         # roles get added to the bottom (position 1, pos 0 is @everyone)
         # so since self.roles has the @everyone role, we can't increment
@@ -150,10 +262,14 @@ class Server(Hashable):
             r.position += bool(r.position)
 
         self.roles.append(role)
+        self._roles[role.id] = role
+        self._invalidate_permissions()
 
     def _remove_role(self, role):
         # this raises ValueError if it fails..
         self.roles.remove(role)
+        self._roles.pop(role.id, None)
+        self._invalidate_permissions()
 
         # since it didn't, we can change the positions now
         # basically the same as above except we only decrement
@@ -181,24 +297,51 @@ class Server(Hashable):
         self.unavailable = guild.get('unavailable', False)
         self.id = guild['id']
         self.roles = [Role(server=self, **r) for r in guild.get('roles', [])]
+        self._roles = {role.id: role for role in self.roles}
+
+        if 'owner_id' in guild:
+            self.owner_id = guild['owner_id']
+
+        self._add_members(guild.get('members', []))
+
+        if 'owner_id' in guild:
+            self.owner = self.get_member(self.owner_id)
+            self._invalidate_permissions()
+
+        self._update_presences(guild.get('presences', []))
+
+        if 'channels' in guild:
+            channels = guild['channels']
+            for c in channels:
+                channel = Channel(server=self, **c)
+                self._add_channel(channel)
+
+        afk_id = guild.get('afk_channel_id')
+        self.afk_channel = self.get_channel(afk_id)
+
+        for obj in guild.get('voice_states', []):
+            self._update_voice_state(obj)
 
-        for data in guild.get('members', []):
+    def _add_members(self, members):
+        """Builds and adds a :class:`Member` for each member payload. Large
+        guilds can be fed to this a chunk at a time."""
+        added = []
+        for data in members:
             roles = [self.default_role]
             for role_id in data['roles']:
-                role = utils.find(lambda r: r.id == role_id, self.roles)
+                role = self._roles.get(role_id)
                 if role is not None:
                     roles.append(role)
 
             data['roles'] = roles
             member = Member(**data)
             member.server = self
-            self._add_member(member)
+            self._store_member(member)
+            added.append(member)
+        self._invalidate_members(added)
 
-        if 'owner_id' in guild:
-            self.owner_id = guild['owner_id']
-            self.owner = self.get_member(self.owner_id)
-
-        for presence in guild.get('presences', []):
+    def _update_presences(self, presences):
+        for presence in presences:
             user_id = presence['user']['id']
             member = self.get_member(user_id)
             if member is not None:
@@ -210,18 +353,6 @@ class Server(Hashable):
                 game = presence.get('game', {})
                 member.game = Game(**game) if game else None
 
-        if 'channels' in guild:
-            channels = guild['channels']
-            for c in channels:
-                channel = Channel(server=self, **c)
-                self._add_channel(channel)
-
-        afk_id = guild.get('afk_channel_id')
-        self.afk_channel = self.get_channel(afk_id)
-
-        for obj in guild.get('voice_states', []):
-            self._update_voice_state(obj)
-
     @utils.cached_slot_property('_default_role')
     def default_role(self):
         """Gets the @everyone role that all members have by default."""
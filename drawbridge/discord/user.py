@@ -26,52 +26,24 @@ DEALINGS IN THE SOFTWARE.
 
 from .utils import snowflake_time
 from .enums import DefaultAvatar
+import weakref
 
-class User(object):
-    """Represents a Discord user.
+# Every user we currently know about, by id. Members and message authors
+# point at these records so that someone sharing many servers with us is
+# only stored, and updated, once.
+_users = weakref.WeakValueDictionary()
 
-    Supported Operations:
+class _BaseUser(object):
+    """The behaviour shared by :class:`User` and :class:`Member`. Subclasses
+    provide ``name``, ``id``, ``discriminator``, ``avatar`` and ``bot``."""
 
-    +-----------+---------------------------------------------+
-    | Operation |                 Description                 |
-    +===========+=============================================+
-    | x == y    | Checks if two users are equal.              |
-    +-----------+---------------------------------------------+
-    | x != y    | Checks if two users are not equal.          |
-    +-----------+---------------------------------------------+
-    | hash(x)   | Return the user's hash.                     |
-    +-----------+---------------------------------------------+
-    | str(x)    | Returns the user's name with discriminator. |
-    +-----------+---------------------------------------------+
-
-    Attributes
-    -----------
-    name : str
-        The user's username.
-    id : str
-        The user's unique ID.
-    discriminator : str or int
-        The user's discriminator. This is given when the username has conflicts.
-    avatar : str
-        The avatar hash the user has. Could be None.
-    bot : bool
-        Specifies if the user is a bot account.
-    """
-
-    __slots__ = ['name', 'id', 'discriminator', 'avatar', 'bot']
-
-    def __init__(self, **kwargs):
-        self.name = kwargs.get('username')
-        self.id = kwargs.get('id')
-        self.discriminator = kwargs.get('discriminator')
-        self.avatar = kwargs.get('avatar')
-        self.bot = kwargs.get('bot', False)
+    __slots__ = []
 
     def __str__(self):
         return '{0.name}#{0.discriminator}'.format(self)
 
     def __eq__(self, other):
-        return isinstance(other, User) and other.id == self.id
+        return isinstance(other, _BaseUser) and other.id == self.id
 
     def __ne__(self, other):
         return not self.__eq__(other)
@@ -151,3 +123,65 @@ class User(object):
             return True
 
         return False
+
+class User(_BaseUser):
+    """Represents a Discord user.
+
+    Supported Operations:
+
+    +-----------+---------------------------------------------+
+    | Operation |                 Description                 |
+    +===========+=============================================+
+    | x == y    | Checks if two users are equal.              |
+    +-----------+---------------------------------------------+
+    | x != y    | Checks if two users are not equal.          |
+    +-----------+---------------------------------------------+
+    | hash(x)   | Return the user's hash.                     |
+    +-----------+---------------------------------------------+
+    | str(x)    | Returns the user's name with discriminator. |
+    +-----------+---------------------------------------------+
+
+    Attributes
+    -----------
+    name : str
+        The user's username.
+    id : str
+        The user's unique ID.
+    discriminator : str or int
+        The user's discriminator. This is given when the username has conflicts.
+    avatar : str
+        The avatar hash the user has. Could be None.
+    bot : bool
+        Specifies if the user is a bot account.
+    """
+
+    __slots__ = ['name', 'id', 'discriminator', 'avatar', 'bot', '__weakref__']
+
+    def __init__(self, **kwargs):
+        self.name = kwargs.get('username')
+        self.id = kwargs.get('id')
+        self.discriminator = kwargs.get('discriminator')
+        self.avatar = kwargs.get('avatar')
+        self.bot = kwargs.get('bot', False)
+
+    def _update(self, **kwargs):
+        # partial user objects (e.g. in presence updates) only carry what changed
+        self.name = kwargs.get('username', self.name)
+        self.discriminator = kwargs.get('discriminator', self.discriminator)
+        self.avatar = kwargs.get('avatar', self.avatar)
+        self.bot = kwargs.get('bot', self.bot)
+
+    @classmethod
+    def _intern(cls, data):
+        """Returns the shared :class:`User` for a user payload, creating it
+        if this is the first time we hear of them and bringing it up to date
+        with the payload otherwise (webhooks, for one, post under a
+        different name every time)."""
+        user = _users.get(data.get('id'))
+        if user is None:
+            user = cls(**data)
+            if user.id is not None:
+                _users[user.id] = user
+        else:
+            user._update(**data)
+        return user
@@ -25,6 +25,7 @@ DEALINGS IN THE SOFTWARE.
 """
 
 from re import split as re_split
+from collections import OrderedDict
 import datetime
 from base64 import b64encode
 import json
@@ -79,6 +80,20 @@ def cached_slot_property_old(name):
 
 def parse_time(timestamp):
     if timestamp:
+        # Discord timestamps look like 2015-08-21T12:03:45.782000+00:00,
+        # sometimes without the fraction, so slice that layout directly and
+        # only fall back to splitting for anything else.
+        if timestamp[10:11] == 'T' and timestamp[19:20] in ('.', '+', ''):
+            microsecond = 0
+            if timestamp[19:20] == '.':
+                fraction = timestamp[20:26]
+                end = fraction.find('+')
+                if end != -1:
+                    fraction = fraction[:end]
+                microsecond = int(fraction.ljust(6, '0'))
+            return datetime.datetime(int(timestamp[0:4]), int(timestamp[5:7]), int(timestamp[8:10]),
+                                     int(timestamp[11:13]), int(timestamp[14:16]), int(timestamp[17:19]),
+                                     microsecond)
         return datetime.datetime(*map(int, re_split(r'[^\d]', timestamp.replace('+00:00', ''))))
     return None
 
@@ -218,6 +233,51 @@ def get(iterable, **attrs):
     return find(predicate, iterable)
 
 
+class LRUDict(object):
+    """A mapping that holds at most ``maxsize`` items, dropping the least
+    recently used one when full. Keys in ``pinned`` are never dropped.
+    ``on_evict`` is called with every value that gets dropped."""
+
+    def __init__(self, maxsize, on_evict=None):
+        self.maxsize = maxsize
+        self.on_evict = on_evict
+        self.pinned = set()
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def get(self, key, default=None):
+        try:
+            value = self._items.pop(key)
+        except KeyError:
+            return default
+        self._items[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._items.pop(key, None)
+        self._items[key] = value
+        while len(self._items) > self.maxsize:
+            oldest = next((k for k in self._items if k not in self.pinned), None)
+            if oldest is None:
+                break
+            evicted = self._items.pop(oldest)
+            if self.on_evict is not None:
+                self.on_evict(evicted)
+
+    def pop(self, key, default=None):
+        return self._items.pop(key, default)
+
+    def values(self):
+        return self._items.values()
+
 def _unique(iterable):
     seen = set()
     adder = seen.add
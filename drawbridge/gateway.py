@@ -0,0 +1,227 @@
+import json
+import re
+import zlib
+
+from autobahn.twisted.websocket import WebSocketClientFactory, WebSocketClientProtocol, connectWS
+from twisted.internet import task
+from twisted.python import log
+
+# The models expect v5 payloads (string channel types and such)
+GATEWAY_VERSION = 5
+
+# Gateway opcodes
+DISPATCH = 0
+HEARTBEAT = 1
+IDENTIFY = 2
+RESUME = 6
+RECONNECT = 7
+REQUEST_GUILD_MEMBERS = 8
+INVALID_SESSION = 9
+HELLO = 10
+HEARTBEAT_ACK = 11
+
+# Close codes after which reconnecting would only fail again
+FATAL_CLOSE_CODES = (4004, 4010, 4011)
+# Close codes that mean the session can't be resumed any more
+SESSION_CLOSE_CODES = (4007, 4009)
+
+# Every complete zlib-stream message ends in a Z_SYNC_FLUSH
+ZLIB_SUFFIX = b'\x00\x00\xff\xff'
+
+_decode = json.JSONDecoder().raw_decode
+_whitespace = re.compile(r'[ \t\n\r]*').match
+
+
+class _Scanner(object):
+    """Walks a JSON document one value at a time, so the caller decides
+    which parts get decoded and when."""
+
+    def __init__(self, text):
+        self.text = text
+        self.idx = 0
+
+    def peek(self):
+        self.idx = _whitespace(self.text, self.idx).end()
+        return self.text[self.idx:self.idx + 1]
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError('Expected {!r} at char {}'.format(char, self.idx))
+        self.idx += 1
+
+    def value(self):
+        self.peek()
+        value, self.idx = _decode(self.text, self.idx)
+        return value
+
+    def keys(self):
+        """Yields each key of the object at the cursor. Its value has to be
+        consumed before the next key is asked for."""
+        self.expect('{')
+        if self.peek() == '}':
+            self.idx += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.peek() != ',':
+                break
+            self.idx += 1
+        self.expect('}')
+
+    def elements(self):
+        """Yields each value of the array at the cursor, decoding them one
+        at a time."""
+        self.expect('[')
+        if self.peek() == ']':
+            self.idx += 1
+            return
+        while True:
+            yield self.value()
+            if self.peek() != ',':
+                break
+            self.idx += 1
+        self.expect(']')
+
+
+def parse_message(text):
+    """Decodes a gateway message. READY can run to tens of megabytes for big
+    accounts, so its guilds are left in the text and only decoded one at a
+    time as they are iterated. Everything else decodes as usual."""
+    scanner = _Scanner(text)
+    msg = {}
+    keys = scanner.keys()
+    for key in keys:
+        if key == 'd' and msg.get('t') == 'READY' and 'op' in msg and 's' in msg:
+            msg['d'], lazy = _parse_ready(scanner)
+            if lazy:
+                # nothing after d that we need, and the guilds have to be
+                # iterated before we could get to it anyway
+                return msg
+        else:
+            msg[key] = scanner.value()
+    return msg
+
+
+# What on_ready needs before it can start on the guilds
+_READY_FIRST = ('user', 'session_id')
+
+
+def _parse_ready(scanner):
+    data = {}
+    keys = scanner.keys()
+    for key in keys:
+        if key == 'guilds' and all(k in data for k in _READY_FIRST):
+            data['guilds'] = _ready_guilds(scanner, keys, data)
+            return data, True
+        data[key] = scanner.value()
+    return data, False
+
+
+def _ready_guilds(scanner, keys, data):
+    for guild in scanner.elements():
+        yield guild
+    # then whatever came after the guilds, private channels and such
+    for key in keys:
+        data[key] = scanner.value()
+
+
+class GatewayProtocol(WebSocketClientProtocol):
+    """One websocket connection to the discord gateway. Session state lives
+    on the client so that it survives the connection being replaced."""
+
+    _heartbeat = None
+    _acked = True
+    _inflator = None
+
+    def onMessage(self, payload, isBinary):
+        client = self.factory.client
+        client.bytes_received += len(payload)
+        if isBinary:
+            # zlib-stream: one deflate stream for the whole connection, and
+            # a message may be split over several frames.
+            if self._inflator is None:
+                self._inflator = zlib.decompressobj()
+                self._frames = []
+            self._frames.append(payload)
+            if not payload.endswith(ZLIB_SUFFIX):
+                return
+            payload = self._inflator.decompress(b''.join(self._frames))
+            self._frames = []
+        client.bytes_inflated += len(payload)
+        self.handle_payload(parse_message(payload))
+
+    def handle_payload(self, msg):
+        client = self.factory.client
+        op = msg.get('op')
+        if msg.get('s') is not None:
+            client.seq = msg['s']
+
+        if op == DISPATCH:
+            client.dispatch(msg['t'], msg['d'])
+        elif op == HELLO:
+            self.start_heartbeat(msg['d']['heartbeat_interval'] / 1000.0)
+            client.gateway_hello(self)
+        elif op == HEARTBEAT:
+            self.send_heartbeat()
+        elif op == HEARTBEAT_ACK:
+            self._acked = True
+        elif op == RECONNECT:
+            # discord wants us elsewhere, closing gets us resumed there
+            self.sendClose()
+        elif op == INVALID_SESSION:
+            client.invalid_session(self, msg['d'])
+
+    def send(self, op, data):
+        self.sendMessage(json.dumps({'op': op, 'd': data}))
+
+    def start_heartbeat(self, interval):
+        self.stop_heartbeat()
+        self._heartbeat = task.LoopingCall(self.send_heartbeat)
+        self._heartbeat.clock = self.factory.reactor
+        self._heartbeat.start(interval, now=False)
+
+    def stop_heartbeat(self):
+        if self._heartbeat is not None and self._heartbeat.running:
+            self._heartbeat.stop()
+        self._heartbeat = None
+
+    def send_heartbeat(self):
+        if not self._acked:
+            # No ack since the last one, the connection is dead even if
+            # the socket hasn't noticed yet.
+            log.msg('Gateway heartbeat not acknowledged, reconnecting')
+            self.stop_heartbeat()
+            self.dropConnection(abort=True)
+            return
+        self._acked = False
+        self.send(HEARTBEAT, self.factory.client.seq)
+
+    def onClose(self, wasClean, code, reason):
+        self.stop_heartbeat()
+        self.factory.client.gateway_closed(self, code, reason)
+
+
+class GatewayFactory(WebSocketClientFactory):
+    protocol = GatewayProtocol
+
+    def __init__(self, client, url, reactor):
+        WebSocketClientFactory.__init__(self, url, reactor=reactor)
+        self.client = client
+
+    def clientConnectionFailed(self, connector, reason):
+        # Never got as far as a protocol (DNS, TCP or TLS failed), so
+        # there'll be no onClose to tell the client
+        self.client.gateway_failed(reason)
+
+
+def connect(client, url, reactor, compress=True):
+    """Opens a gateway connection for client, which gets called back with
+    gateway_hello, dispatch, invalid_session and gateway_closed, or
+    gateway_failed if the connection couldn't be made at all. With
+    compress the gateway sends everything as one zlib stream."""
+    url = '{}?v={}&encoding=json'.format(url.rstrip('/'), GATEWAY_VERSION)
+    if compress:
+        url += '&compress=zlib-stream'
+    return connectWS(GatewayFactory(client, url, reactor))
@@ -11,8 +11,10 @@ from twisted.words import service, iwords, ewords
 from twisted.words.protocols import irc
 from twisted.logger import LogLevel
 
-from realm import DiscordWordsRealm, User
+from realm import DiscordWordsRealm, User, sessions
 from auth import DiscordAuthenticator
+from rest import connection_pool
+from spool import outbound
 
 import chord
 from unidecode import unidecode
@@ -42,66 +44,12 @@ class IRCProtocol(service.IRCUser):
         self.irc_PRIVMSG = self.irc_REJECT_PRIVMSG
         self.realm = DiscordWordsRealm('discord.gg')
         self.hostname = self.realm.name
-        self._guilds = {}
-        self._private_channels = {}
-        self._private_channels_by_user = {}
 
     def connectionLost(self, reason):
-        self._guilds = {}
-        self._private_channels = {}
-        self._private_channels_by_user = {}
-
-        if self.logout is not None:
-            self.avatar.disconnect(reason)
+        if self.avatar is not None:
+            # The discord session lives on if other clients are attached
+            defer.maybeDeferred(self.avatar.detach, self, reason)
             del self.avatar
-            defer.maybeDeferred(self.logout)
-
-    @property
-    def guilds(self):
-        return self._guilds.values()
-
-    def add_guild(self, guild):
-        self._guilds[guild.id] = guild
-
-    def get_guild(self, guild_id):
-        return self._guilds.get(guild_id)
-
-    def remove_guild(self, guild):
-        self._guilds.pop(guild.id, None)
-
-    def get_channel(self, id):
-        if id is None:
-            return None
-
-        for guild in self.guilds:
-            channel = guild.get_channel(id)
-            if channel is not None:
-                return channel
-
-        pm = self.get_private_channel(id)
-        if pm is not None:
-            return pm
-
-    def get_channel_by_name(self, name):
-        raise ValueError('NYI')
-
-    @property
-    def private_channels(self):
-        return self._private_channels.values()
-
-    def get_private_channel(self, channel_id):
-        return self._private_channels.get(channel_id)
-
-    def get_private_channel_by_user(self, user_id):
-        return self._private_channels_by_user.get(user_id)
-
-    def add_private_channel(self, channel):
-        self._private_channels[channel.id] = channel
-        self._private_channels_by_user[channel.user.id] = channel
-
-    def remove_private_channel(self, channel):
-        self._private_channels.pop(channel.id, None)
-        self._private_channels_by_user.pop(channel.user.id, None)
 
     def svc_message(self, message):
         self.notice(DISCORD, self.nickname, message)
@@ -119,6 +67,21 @@ class IRCProtocol(service.IRCUser):
             self.svc_message("Please wait until authentication has completed to send messages.")
 
 
+    def irc_PRIVMSG(self, prefix, params):
+        """Send a (private) message, messages to Discord are service
+        commands.
+        Parameters: <msgtarget> <text to be sent>
+        """
+        if self.avatar is not None and params and params[0].lower() == 'discord':
+            command = params[-1].strip().lower()
+            if command == 'stats':
+                for line in self.avatar.stats():
+                    self.svc_message(line)
+            else:
+                self.svc_message('Unknown command {!r}, try stats'.format(command))
+            return
+        return service.IRCUser.irc_PRIVMSG(self, prefix, params)
+
     def irc_WHOIS(self, prefix, params):
         """Whois query
         Parameters: [ <target> ] <mask> *( "," <mask> )
@@ -149,6 +112,44 @@ class IRCProtocol(service.IRCUser):
 
         self.realm.lookupUser(user).addCallbacks(cbUser, ebUser)
 
+    def irc_NAMES(self, prefix, params):
+        """Names message, answered with the discord members that can read
+        the channel rather than the IRC clients in it. Asking is also what
+        gets all the members of a large server loaded.
+        Parameters: [ <channel> *( "," <channel> ) [ <target> ] ]
+        """
+        if self.avatar is None or not params:
+            return service.IRCUser.irc_NAMES(self, prefix, params)
+
+        def cbGroup(group):
+            self.avatar.request_members(group.server)
+            self.names(self.name, '#' + group.name, self.avatar.channel_names(group.channel))
+
+        def ebGroup(err):
+            err.trap(ewords.NoSuchGroup)
+            self.names(self.name, params[-1], [])
+
+        try:
+            channel = params[-1].decode(self.encoding)
+        except UnicodeDecodeError:
+            self.sendMessage(
+                irc.ERR_NOSUCHCHANNEL, params[-1],
+                ":No such channel (could not decode your unicode!)")
+            return
+
+        self.realm.lookupGroup(channel.lstrip('#')).addCallbacks(cbGroup, ebGroup)
+
+    def irc_WHO(self, prefix, params):
+        """Who query, also gets the members of a large server loaded.
+        Parameters: [ <mask> [ "o" ] ]
+        """
+        if self.avatar is not None and params and params[0].startswith('#'):
+            def cbGroup(group):
+                self.avatar.request_members(group.server)
+            d = self.realm.lookupGroup(params[0][1:].decode(self.encoding, 'replace'))
+            d.addCallbacks(cbGroup, lambda err: None)
+        return service.IRCUser.irc_WHO(self, prefix, params)
+
     def irc_NICK(self, prefix, params):
         """Nick message -- Set your nickname.
         Parameters: <nickname> [password]
@@ -210,14 +211,25 @@ class IRCProtocol(service.IRCUser):
         sender = '{}!{}@discord.gg'.format(self.nickname, self._authenticator.meta.get('discriminator'))
         self.sendLine(':{} NICK :{}'.format(sender, nick))
         self.nickname = nick
-        self.avatar = User(self.nickname, self._authenticator)
-        self.avatar.protocol = self
-        self.avatar.loggedIn(self.realm, self)
 
-        self.logout = self._authenticator.logout
         for code, text in self._welcomeMessages:
             self.sendMessage(code, text % self.factory._serverInfo)
 
+        # Already connected from somewhere else? Share that session instead
+        # of logging in to discord all over again.
+        session = sessions.get(self._authenticator.token)
+        if session is not None:
+            self.avatar = session
+            session.attach(self)
+            return
+
+        self.avatar = User(self.nickname, self._authenticator)
+        self.avatar.detach_timeout = self.factory.detach_timeout
+        self.avatar.backlog_size = self.factory.backlog_size
+        self.avatar.paste_window = self.factory.paste_window
+        self.avatar.protocol = self
+        self.avatar.loggedIn(self.realm, self)
+
     def _ebLogin(self, err, nickname):
         if err.check(ewords.AlreadyLoggedIn):
             self.svc_message("Already logged in. No pod people allowed!")
@@ -241,8 +253,23 @@ class IRCProtocol(service.IRCUser):
 
 
 class IRCGateway(protocol.ServerFactory):
-    def __init__(self):
+    def __init__(self, detach_timeout=0, backlog_size=500, http_connections=4, spool_path=None,
+                 paste_window=User.paste_window):
+        """detach_timeout is how many seconds a discord session outlives its
+        last IRC client (0 to log out immediately), backlog_size is the most
+        messages it buffers for replay meanwhile. http_connections is the
+        most connections open to discord's API at once, all of them kept
+        open for reuse. With spool_path, messages discord hasn't accepted
+        yet are kept in that file and survive a restart. paste_window is how
+        many seconds to wait for the next line of a paste before sending it
+        as one message, 0 sends every line on its own."""
         self.realm = None
+        self.detach_timeout = detach_timeout
+        self.backlog_size = backlog_size
+        self.paste_window = paste_window
+        connection_pool().set_max_connections(http_connections)
+        if spool_path is not None:
+            outbound.open(spool_path)
         self._serverInfo = {
             "serviceName": 'drawbridge',
             "serviceVersion": 'v 0.1',
@@ -257,6 +284,23 @@ class IRCGateway(protocol.ServerFactory):
 
 
 if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='IRC gateway for discord')
+    parser.add_argument('--detach-timeout', type=float, default=0, metavar='SECONDS',
+                        help='keep a discord session alive this long after its last IRC client '
+                             'disconnects, so that clients can reattach (default: log out at once)')
+    parser.add_argument('--backlog-size', type=int, default=500, metavar='MESSAGES',
+                        help='most messages buffered for a detached session (default: 500)')
+    parser.add_argument('--http-connections', type=int, default=4, metavar='N',
+                        help='most connections open to the discord API at once (default: 4)')
+    parser.add_argument('--spool', metavar='PATH',
+                        help='keep messages discord has not accepted yet in this file, so they '
+                             'are sent after a restart')
+    parser.add_argument('--paste-window', type=float, default=User.paste_window, metavar='SECONDS',
+                        help='send lines that follow each other within this long as one message, '
+                             '0 to send every line on its own (default: %(default)s)')
+    args = parser.parse_args()
+
     chord.start_logging(LogLevel.info)
     #log.startLogging(sys.stdout)
     #log.startLogging(logfile.LogFile('out.log', '.', rotateLength=None))
@@ -267,7 +311,11 @@ if __name__ == '__main__':
     # # IRC server factory.
     # ircfactory = IRCGateway(realm, portal)
     # IRC server factory.
-    ircfactory = IRCGateway()
+    ircfactory = IRCGateway(detach_timeout=args.detach_timeout,
+                            backlog_size=args.backlog_size,
+                            http_connections=args.http_connections,
+                            spool_path=args.spool,
+                            paste_window=args.paste_window)
 
     # Connect a server to the TCP port 6667 endpoint and start listening.
     endpoint = TCP4ServerEndpoint(reactor, 6667)
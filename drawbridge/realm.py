@@ -1,18 +1,27 @@
 
 from twisted.words import ewords
 
-from twisted.internet import defer
-from twisted.python import failure
+from twisted.internet import defer, task
+from twisted.python import failure, log
 from twisted.words import service, iwords
+from twisted.words.protocols import irc
 
 import json
 import chord
+import gateway
+from rest import RESTClient, connection_pool
 from unidecode import unidecode
 
-from discord import Message, Server, Channel, PrivateChannel
+from cache import shared_guilds
+from spool import outbound
+from discord import Message, Server, Channel, PrivateChannel, Role
 from discord import User as DiscordUser
 
-from random import randint as random_integer
+from random import randint as random_integer, uniform
+from collections import OrderedDict, Counter, deque
+from time import time, strftime, localtime
+from bisect import bisect_left
+from math import ceil
 
 from zope.interface import implements
 from Queue import Queue
@@ -131,7 +140,7 @@ class DiscordWordsRealm(service.WordsRealm):
 
 
     def createGroup(self, server, channel):
-        name = channel.name.replace(' ', '_')
+        name = channel.irc_name
         assert isinstance(name, unicode)
         def cbLookup(group):
             return failure.Failure(ewords.DuplicateGroup(name))
@@ -233,14 +242,197 @@ class Group(object):
         return iter(self.users.values())
 
 
+def irc_nick(user):
+    return unidecode(user.name).replace(' ', '_')
+
+def irc_prefix(user):
+    return '{}!{}@discord.gg'.format(irc_nick(user), user.discriminator)
+
+
+class PendingSend(object):
+    """A message we sent, from when its line came in on IRC until the
+    gateway echoes it back."""
+    __slots__ = ('channel_id', 'received', 'sent', 'accepted')
+
+    def __init__(self, channel_id, received, sent):
+        self.channel_id = channel_id
+        self.received = received
+        self.sent = sent
+        self.accepted = None
+
+
+class PendingSends(object):
+    """The messages we sent that haven't been echoed yet, by nonce, so that
+    their gateway echo can be dropped and timed. Bounded in both size and
+    age, the oldest sends are forgotten first.
+
+    >>> sends = PendingSends(maxlen=2)
+    >>> for nonce in (u'1', u'2', u'3'):
+    ...     _ = sends.add(nonce, '5')
+    >>> sends.pop(u'1') is None
+    True
+    >>> sends.pop(u'3').channel_id
+    '5'
+    """
+    def __init__(self, maxlen=1000, ttl=300, clock=time):
+        """maxlen is the most sends kept at once, ttl is how many seconds
+        to wait for an echo before giving up on it."""
+        self.maxlen = maxlen
+        self.ttl = ttl
+        self.clock = clock
+        self._sends = OrderedDict()
+
+    def __len__(self):
+        return len(self._sends)
+
+    def add(self, nonce, channel_id=None, received=None):
+        """Starts tracking nonce. received is when the message came in from
+        IRC, if it did."""
+        self.expire()
+        pending = self._sends[nonce] = PendingSend(channel_id, received, self.clock())
+        while len(self._sends) > self.maxlen:
+            self._sends.popitem(last=False)
+        return pending
+
+    def pop(self, nonce):
+        """Stop tracking nonce. Returns its PendingSend if it was still
+        being tracked."""
+        pending = self._sends.pop(nonce, None)
+        if pending is not None and self.clock() - pending.sent <= self.ttl:
+            return pending
+
+    def expire(self):
+        # Insertion order is send order, so expired sends are all up front.
+        deadline = self.clock() - self.ttl
+        while self._sends:
+            oldest = next(iter(self._sends))
+            if self._sends[oldest].sent > deadline:
+                break
+            del self._sends[oldest]
+
+
+class LatencyHistogram(object):
+    """Counts latencies into buckets that double in width, from a
+    millisecond up, which is plenty to read percentiles off.
+
+    >>> h = LatencyHistogram()
+    >>> for ms in (3, 40, 40, 90, 700):
+    ...     h.add(ms / 1000.0)
+    >>> print h.percentile(50), h.percentile(99)
+    0.064 0.7
+    """
+    bounds = tuple(0.001 * 2 ** i for i in range(18))
+
+    def __init__(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.counts[bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p):
+        """The latency p percent of samples were at or under, rounded up to
+        the bucket it's in."""
+        if not self.count:
+            return None
+        rank = max(1, int(ceil(self.count * p / 100.0)))
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                break
+        if i < len(self.bounds):
+            return min(self.bounds[i], self.max)
+        return self.max
+
+    def summary(self):
+        if not self.count:
+            return 'no samples'
+        return 'p50 {:.0f}ms, p90 {:.0f}ms, p99 {:.0f}ms, max {:.0f}ms ({} samples)'.format(
+            self.percentile(50) * 1000, self.percentile(90) * 1000,
+            self.percentile(99) * 1000, self.max * 1000, self.count)
+
+
+class Paste(object):
+    """Lines waiting to be sent to channel as one message."""
+    def __init__(self, channel, received):
+        self.channel = channel
+        self.received = received
+        self.lines = []
+        self.length = 0
+        self.timer = None
+        self.waiting = []
+
+
+class StallMonitor(object):
+    """Keeps track of the longest time the reactor was blocked while it
+    runs, by checking how late a LoopingCall gets to run."""
+    def __init__(self, reactor, interval=0.05):
+        self.reactor = reactor
+        self.interval = interval
+        self.longest = 0.0
+        self._last = None
+        self._call = None
+
+    def start(self):
+        self._last = self.reactor.seconds()
+        self._call = task.LoopingCall(self._tick)
+        self._call.clock = self.reactor
+        self._call.start(self.interval, now=False)
+
+    def stop(self):
+        """Stops measuring and returns the longest stall in seconds."""
+        if self._call is not None and self._call.running:
+            self._call.stop()
+            self._tick()
+        return self.longest
+
+    def _tick(self):
+        now = self.reactor.seconds()
+        self.longest = max(self.longest, now - self._last - self.interval)
+        self._last = now
+
+
 class DiscordClient(chord.Client):
-    mind = None
+    minds = ()
+    reactor = None
+    _protocol = None
+
+    # Gateway session, kept across connections so a dropped one can be
+    # resumed instead of identifying and rebuilding everything from READY.
+    session_id = None
+    seq = None
+    _token = None
+    _gateway_url = None
+    _closing = False
+    _resuming = False
+    _replayed = 0
+
+    # Seconds to wait before reconnecting a dropped gateway connection,
+    # doubling with every attempt that fails in a row up to the max
+    reconnect_delay = 5
+    max_reconnect_delay = 300
+    _reconnect_attempts = 0
+    # Ask for zlib-stream transport compression
+    compress = True
+    # Gateway bytes as they came off the wire and after inflating
+    bytes_received = 0
+    bytes_inflated = 0
+
+    def svc_message(self, message):
+        for mind in self.minds:
+            mind.svc_message(message)
 
     def handle_error(self, failure):
-        self.mind.svc_message('Uncaught error ' + str(failure.value))
+        self.svc_message('Uncaught error ' + str(failure.value))
         failure.raiseException()
 
     def login(self, token, reactor=None):
+        self._token = token
+        self._closing = False
         self.deferred = self.fetch_gateway(token)
 
         self.deferred.addErrback(self.handle_error)
@@ -248,20 +440,185 @@ class DiscordClient(chord.Client):
 
         return self.deferred
 
+    def connect(self, url):
+        if self._closing:
+            return # logged out before a reconnect came up
+        self._gateway_url = url
+        gateway.connect(self, url, self.reactor, self.compress)
+
+    def transport_stats(self):
+        saved = 0
+        if self.bytes_inflated:
+            saved = 100.0 * (self.bytes_inflated - self.bytes_received) / self.bytes_inflated
+        return '{} bytes received, {} after inflating ({:.1f}% saved)'.format(
+            self.bytes_received, self.bytes_inflated, saved)
+
+    def disconnect(self, reason):
+        self._closing = True
+        self.session_id = None
+        self.seq = None
+        if self._protocol is not None:
+            # reason is for our logs, often a Failure, and the close frame
+            # only takes unicode
+            log.msg('Closing gateway connection: {}'.format(reason))
+            self._protocol.sendClose(1000, u'Logged out')
+
+    def dispatch(self, event, data):
+        if self._resuming and event != 'RESUMED':
+            self._replayed += 1
+        if event == 'READY':
+            self.session_id = data.get('session_id')
+        if self.filter_event(event, data):
+            return
+
+        handler = getattr(self, 'on_' + event.lower(), None)
+        if handler is None:
+            return
+        try:
+            handler(data)
+        except Exception:
+            log.err(None, 'Handling {} failed'.format(event))
+
+    def filter_event(self, event, data):
+        """Return True to drop an event before its handler sees it."""
+        return False
+
+    def gateway_hello(self, protocol):
+        self._protocol = protocol
+        self._reconnect_attempts = 0
+        self._start_session(protocol)
+
+    def _start_session(self, protocol):
+        if self._protocol is not protocol:
+            return # closed or replaced while we waited
+        if self.session_id is not None:
+            self._resuming = True
+            self._replayed = 0
+            protocol.send(gateway.RESUME, {
+                'token': self._token,
+                'session_id': self.session_id,
+                'seq': self.seq
+            })
+        else:
+            self.identify(protocol)
+
+    def identify(self, protocol):
+        protocol.send(gateway.IDENTIFY, {
+            'token': self._token,
+            'properties': {
+                '$os': 'linux',
+                '$browser': 'drawbridge',
+                '$device': 'drawbridge',
+                '$referrer': '',
+                '$referring_domain': ''
+            },
+            # zlib-stream compresses the whole transport already
+            'compress': False,
+            'large_threshold': 250
+        })
+
+    def invalid_session(self, protocol, resumable):
+        if not resumable:
+            self.session_id = None
+            self.seq = None
+            if self._resuming:
+                self.svc_message('Discord could not resume the session, reloading everything.')
+        self._resuming = False
+        # discord asks for a short random wait before trying again, which
+        # resumes if it said we still can and identifies otherwise
+        self.reactor.callLater(uniform(1, 5), self._start_session, protocol)
+
+    def on_resumed(self, data):
+        self._resuming = False
+        self.svc_message('Discord session resumed, {} missed events replayed.'.format(self._replayed))
+
+    def gateway_closed(self, protocol, code, reason):
+        if self._protocol is protocol:
+            self._protocol = None
+        log.msg('Gateway connection closed, ' + self.transport_stats())
+        if self._closing:
+            return
+        if code in gateway.FATAL_CLOSE_CODES:
+            self.svc_message('Discord closed the connection: {}'.format(reason))
+            return
+        if code in gateway.SESSION_CLOSE_CODES:
+            self.session_id = None
+            self.seq = None
+        self._resuming = False
+        self.svc_message('Lost connection to discord, reconnecting.')
+        self._reconnect()
+
+    def gateway_failed(self, reason):
+        log.msg('Gateway connection failed: {}'.format(reason.getErrorMessage()))
+        if self._closing:
+            return
+        self._resuming = False
+        delay = self._reconnect()
+        self.svc_message('Could not connect to discord ({}), trying again in {:.0f}s.'.format(
+            reason.getErrorMessage(), delay))
+
+    def _reconnect(self):
+        delay = min(self.reconnect_delay * 2 ** self._reconnect_attempts, self.max_reconnect_delay)
+        self._reconnect_attempts += 1
+        self.reactor.callLater(delay, self.connect, self._gateway_url)
+        return delay
+
+
+# Discord sessions by token. IRC clients logging in to the same account
+# share one session and gateway connection.
+sessions = {}
+
 
 class User(DiscordClient):
     implements(iwords.IUser)
 
     meta = None
     realm = None
-    _protocol = None
 
     server_id = None
+    rest = None
     gateway = ''
     realName = ''
-    _lazy_guilds = 0
 
-    _sent_nonces = []
+    # Seconds to keep the session alive after the last IRC client leaves,
+    # 0 logs out right away.
+    detach_timeout = 0
+    # Most messages kept for replay while no IRC client is attached
+    backlog_size = 500
+    _expiry = None
+
+    # Events we never show on IRC, dropped before they reach a handler
+    ignored_events = frozenset([
+        'TYPING_START', 'PRESENCE_UPDATE', 'MESSAGE_ACK', 'CHANNEL_PINS_UPDATE',
+        'MESSAGE_REACTION_ADD', 'MESSAGE_REACTION_REMOVE', 'MESSAGE_REACTION_REMOVE_ALL',
+        'VOICE_STATE_UPDATE', 'VOICE_SERVER_UPDATE', 'GUILD_EMOJIS_UPDATE',
+        'GUILD_INTEGRATIONS_UPDATE', 'WEBHOOKS_UPDATE', 'USER_SETTINGS_UPDATE',
+        'USER_NOTE_UPDATE', 'USER_GUILD_SETTINGS_UPDATE', 'RELATIONSHIP_ADD',
+        'RELATIONSHIP_REMOVE'
+    ])
+    # Events that only matter if they're in a channel of the active server.
+    # Anything that changes guild state has to get through regardless, the
+    # parsed guilds are shared with other sessions.
+    channel_events = frozenset([
+        'MESSAGE_CREATE', 'MESSAGE_UPDATE', 'MESSAGE_DELETE', 'MESSAGE_DELETE_BULK'
+    ])
+
+    # Seconds to wait for the next line of a paste before sending what we
+    # have as one message, 0 sends every line on its own
+    paste_window = 0.3
+    max_message_length = 2000
+    _paste = None
+
+    # How many members/presences READY handles before yielding to the reactor
+    ready_chunk_size = 500
+    # Large guilds keep at most this many members loaded and ask the gateway
+    # for the rest when they're needed, None loads every member up front.
+    member_cache_size = 5000
+    # Seconds before the same member request is sent again
+    member_request_interval = 60
+    # Longest the reactor was held up while the last READY was processed
+    ready_stall = None
+    _ready = None
 
     def __init__(self, name, credentials=None, reactor=None):
         if reactor is None:
@@ -271,65 +628,323 @@ class User(DiscordClient):
         self.name = name
         self.id = name
         self.groups = []
+        self.minds = []
+        self.backlog = deque()
+        self._backlog_dropped = 0
+        self._guilds = {}
+        self._channels = {}
+        self._private_channels = {}
+        self._private_channels_by_user = {}
+        self._pending_sends = PendingSends(clock=reactor.seconds)
+        self.send_latency = {
+            'accepted': LatencyHistogram(),
+            'echoed': LatencyHistogram(),
+        }
+        self.channel_latency = {}
+        self._lazy_guilds = set()
+        self._member_requests = OrderedDict()
+        self._held_events = deque()
+        # Guilds from GUILD_CREATE being loaded, and the events for them
+        # held back meanwhile
+        self._loaders = {}
+        self._loading = {}
+        self._loading_channels = {}
+        self.events_processed = Counter()
+        self.events_filtered = Counter()
         self.credentials = credentials
         if self.credentials:
+            self.rest = RESTClient(credentials.token, reactor)
             self.set_meta(credentials.meta)
 
     def loggedIn(self, realm, mind):
         self.realm = realm
-        self.mind = mind
+        self.minds.append(mind)
         if self.credentials:
+            sessions[self.credentials.token] = self
             defer.maybeDeferred(self.login, self.credentials.token)
+            outbound.resume(self)
+
+    def attach(self, mind):
+        """Lets another IRC client in on this already logged in session. It
+        gets joined to the channels straight from the parsed guilds, and
+        is sent whatever came in while nobody was attached."""
+        if self._expiry is not None:
+            self._expiry.cancel()
+            self._expiry = None
+
+        self.minds.append(mind)
+        mind.svc_message('Attached to your existing discord session.')
+        server = self.get_guild(self.server_id)
+        if server is not None:
+            d = task.cooperate(self._join_channels(mind, server)).whenDone()
+        else:
+            d = defer.succeed(None)
+        d.addCallback(lambda _: self._replay_backlog(mind))
+
+    def detach(self, mind, reason):
+        """Called when an IRC client goes away. Once the last one is gone
+        the session is kept around for detach_timeout seconds in case one
+        comes back, and logged out of discord after that."""
+        if mind in self.minds:
+            self.minds.remove(mind)
+        if self.minds:
+            return defer.succeed(None)
+
+        if self.detach_timeout > 0:
+            self._expiry = self.reactor.callLater(self.detach_timeout, self._end_session, reason)
+            return defer.succeed(None)
+        return self._end_session(reason)
+
+    def _end_session(self, reason):
+        self._expiry = None
+        self.backlog.clear()
+        if sessions.get(self.credentials.token) is self:
+            del sessions[self.credentials.token]
+        try:
+            self._flush_paste()
+            self.disconnect(reason)
+        except Exception:
+            # whatever went wrong, the guilds and the token still have to go
+            log.err(None, 'Closing the discord session for {} failed'.format(self.name))
+        self._drop_guilds()
+        return defer.maybeDeferred(self.credentials.logout)
+
+    def _drop_guilds(self):
+        # Stop loading guilds first, what they'd add is going away anyway
+        loaders, self._loaders = self._loaders, {}
+        self._loading = {}
+        self._loading_channels = {}
+        for loader in loaders.values():
+            loader.stop()
+        for guild in self.guilds:
+            shared_guilds.release(guild)
+        self._guilds = {}
+        self._channels = {}
+        self._private_channels = {}
+        self._private_channels_by_user = {}
+        self._lazy_guilds = set()
+
+    def _privmsg(self, sender, channel, line):
+        if not self.minds:
+            # Detached, hang on to it for whoever attaches next
+            if len(self.backlog) >= self.backlog_size:
+                self.backlog.popleft()
+                self._backlog_dropped += 1
+            self.backlog.append((time(), sender, channel, line))
+        for mind in self.minds:
+            mind.privmsg(sender, channel, line)
+
+    def _replay_backlog(self, mind):
+        if self._backlog_dropped:
+            mind.svc_message('{} older messages did not fit in the backlog.'.format(self._backlog_dropped))
+        for received, sender, channel, line in self.backlog:
+            mind.privmsg(sender, channel, strftime('[%H:%M:%S] ', localtime(received)) + line)
+        self.backlog.clear()
+        self._backlog_dropped = 0
+
+    def _mind_for(self, group):
+        # Every IRC client has a realm of its own, so a group belongs to
+        # whichever client's realm knows it.
+        for mind in self.minds:
+            if mind.realm.guilds.get(group.name) is group:
+                return mind
 
     def join(self, group):
         def cbJoin(result):
             self.groups.append(group)
             return result
-        return group.add(self.mind).addCallback(cbJoin)
+        return group.add(self._mind_for(group)).addCallback(cbJoin)
 
 
     def leave(self, group, reason=None):
         def cbLeave(result):
             self.groups.remove(group)
             return result
-        return group.remove(self.mind, reason).addCallback(cbLeave)
+        return group.remove(self._mind_for(group), reason).addCallback(cbLeave)
 
 
     def send(self, recipient, message):
-        # Send to IRC first
-        recipient.receive(self.mind, recipient, message)
+        mind = self._mind_for(recipient) if isinstance(recipient, Group) else None
+
+        channel = None
+        if mind is not None:
+            server = self.get_guild(self.server_id)
+            if server is not None:
+                channel = server.get_channel_by_irc_name(recipient.name)
+
+        if channel is None:
+            # Nothing on discord to deliver this to, don't bother asking.
+            for m in [mind] if mind is not None else self.minds:
+                m.sendMessage(irc.ERR_CANNOTSENDTOCHAN, '#' + recipient.name, ':Cannot send to channel')
+            return defer.succeed(None)
+
+        # Send to IRC first, including our other clients
+        recipient.receive(mind, recipient, message)
+        for other in self.minds:
+            if other is not mind:
+                sender = '{}!{}@discord.gg'.format(other.nickname, self.meta['discriminator'])
+                other.privmsg(sender, '#' + channel.irc_name, message.get('text', ''))
 
         message = message.get('text', '')
         if message.startswith('\x01ACTION '):
             message = message.replace('ACTION ', '', 1).replace('\x01', '_')
+        if isinstance(message, str):
+            message = message.decode('utf-8', 'replace')
 
-        channel_id = None
-        if isinstance(recipient, Group):
-            server = self.mind.get_guild(self.server_id)
-            for chan in server.channels:
-                irc_chan_name = chan.name.replace(' ', '_')
-                if irc_chan_name == recipient.name:
-                    channel_id = chan.id
+        if not self.paste_window:
+            d = self._post_message(channel, message)
+        else:
+            d = self._add_to_paste(channel, message)
+        # The spool has already sent a NOTICE about a message it gave up on,
+        # twisted.words has nothing to do with the failure but log it as
+        # unhandled.
+        d.addErrback(lambda err: None)
+        return d
 
-        url = 'https://discordapp.com/api/channels/{0}/messages'.format(channel_id)
-        nonce = random_integer(-2**63, 2**63 - 1)
-        payload = {
-            'content': unicode(message),
-            'nonce': nonce
-        }
-        self._sent_nonces.append(unicode(nonce))
+    def _add_to_paste(self, channel, line):
+        # IRC clients send a paste a line at a time. Lines for the same
+        # channel that come in quick succession go out as one message.
+        paste = self._paste
+        if paste is not None and (paste.channel is not channel or
+                                  paste.length + 1 + len(line) > self.max_message_length):
+            self._flush_paste()
+            paste = None
+
+        if paste is None:
+            paste = self._paste = Paste(channel, self.reactor.seconds())
+        paste.lines.append(line)
+        paste.length += len(line) + (len(paste.lines) > 1)
+
+        # wait for the paste to go quiet
+        if paste.timer is not None:
+            paste.timer.cancel()
+        paste.timer = self.reactor.callLater(self.paste_window, self._flush_paste)
+
+        d = defer.Deferred()
+        paste.waiting.append(d)
+        return d
 
-        return chord.http_post(url, self.credentials.token, payload)
+    def _flush_paste(self):
+        paste, self._paste = self._paste, None
+        if paste is None:
+            return
+        if paste.timer is not None and paste.timer.active():
+            paste.timer.cancel()
+
+        def done(result):
+            for d in paste.waiting:
+                d.callback(result)
+
+        def failed(err):
+            for d in paste.waiting:
+                d.errback(err)
+
+        d = self._post_message(paste.channel, u'\n'.join(paste.lines), paste.received)
+        d.addCallbacks(done, failed)
+
+    def _post_message(self, channel, content, received=None):
+        if received is None:
+            received = self.reactor.seconds()
+        nonce = random_integer(-2**63, 2**63 - 1)
+        pending = self._pending_sends.add(unicode(nonce), channel.id, received)
+
+        return outbound.send(self, channel.id, content, nonce,
+                             accepted=lambda result: self._send_accepted(pending))
+
+    def _send_accepted(self, pending):
+        # only ever from the REST response, the echo may well come first
+        pending.accepted = self.reactor.seconds()
+        self._record_latency('accepted', pending.channel_id, pending.accepted - pending.received)
+
+    def stats(self):
+        """Lines describing how this session is doing, for the stats
+        service command."""
+        lines = [
+            'Sends: {} awaiting their echo, {} in the spool ({} retries, {} given up on)'.format(
+                len(self._pending_sends), len(outbound), outbound.retried, outbound.failed),
+            'IRC to REST accepted: ' + self.send_latency['accepted'].summary(),
+            'IRC to gateway echo: ' + self.send_latency['echoed'].summary(),
+        ]
+        for channel_id, latency in self.channel_latency.items():
+            channel = self.get_channel(channel_id)
+            name = '#' + channel.irc_name if channel is not None else channel_id
+            lines.append('{}: accepted {}; echoed {}'.format(
+                name, latency['accepted'].summary(), latency['echoed'].summary()))
+        lines += [
+            'REST: ' + self.rest.stats(),
+            'HTTP: ' + connection_pool().stats(),
+            'Gateway: ' + self.transport_stats(),
+            'Events: {} processed, {} filtered'.format(
+                sum(self.events_processed.values()), sum(self.events_filtered.values())),
+        ]
+        return lines
+
+    def _record_latency(self, stage, channel_id, seconds):
+        """Adds a send latency to the session's histogram for stage and to
+        the one for the channel."""
+        self.send_latency[stage].add(seconds)
+        channel = self.channel_latency.get(channel_id)
+        if channel is None:
+            channel = self.channel_latency[channel_id] = {
+                'accepted': LatencyHistogram(),
+                'echoed': LatencyHistogram(),
+            }
+        channel[stage].add(seconds)
 
 
     def itergroups(self):
         return iter(self.groups)
 
+    @property
+    def guilds(self):
+        return self._guilds.values()
+
+    def add_guild(self, guild):
+        # guild has to be acquired from shared_guilds already, we hand it
+        # back when it's removed or the session ends.
+        self._guilds[guild.id] = guild
+        for channel in guild.channels:
+            self._channels[channel.id] = channel
+
+    def get_guild(self, guild_id):
+        return self._guilds.get(guild_id)
+
+    def remove_guild(self, guild):
+        if self._guilds.pop(guild.id, None) is None:
+            return
+        for channel in guild.channels:
+            self._channels.pop(channel.id, None)
+        shared_guilds.release(guild)
+
+    def get_channel(self, id):
+        # Every guild and private channel is indexed by id as it is added,
+        # so this stays a single dict lookup no matter how many guilds the
+        # account is in.
+        return self._channels.get(id)
+
+    @property
+    def private_channels(self):
+        return self._private_channels.values()
+
+    def get_private_channel(self, channel_id):
+        return self._private_channels.get(channel_id)
+
+    def get_private_channel_by_user(self, user_id):
+        return self._private_channels_by_user.get(user_id)
+
+    def add_private_channel(self, channel):
+        self._private_channels[channel.id] = channel
+        self._private_channels_by_user[channel.user.id] = channel
+        self._channels[channel.id] = channel
+
+    def remove_private_channel(self, channel):
+        self._private_channels.pop(channel.id, None)
+        self._private_channels_by_user.pop(channel.user.id, None)
+        self._channels.pop(channel.id, None)
+
 
     def logout(self):
         self.disconnect(u'Leaving...')
-        if (self._protocol):
-            self._protocol.sendClose()
         for g in self.groups[:]:
             self.leave(g)
 
@@ -340,50 +955,89 @@ class User(DiscordClient):
         self.name = meta['username']
         self.id = meta['id']
 
+    def dispatch(self, event, data):
+        if self._ready is not None and event != 'READY':
+            # READY is still being worked through and what these events
+            # change may not be there yet, hold them until it's done
+            self._held_events.append((event, data))
+            return
+        if self._loading and isinstance(data, dict):
+            held = self._loading.get(self._guild_of(event, data))
+            if held is not None:
+                held.append((event, data))
+                return
+        DiscordClient.dispatch(self, event, data)
+
+    def _guild_of(self, event, data):
+        # Which guild an event is about, as far as that can be told without
+        # the guild (only used for guilds still being loaded)
+        guild_id = data.get('guild_id')
+        if guild_id is None and event.startswith('GUILD_'):
+            guild_id = data.get('id')
+        if guild_id is None:
+            guild_id = self._loading_channels.get(data.get('channel_id'))
+        return guild_id
+
+    def filter_event(self, event, data):
+        # Only dict lookups here, this runs for every event before anything
+        # gets built from it.
+        if event in self.ignored_events:
+            filtered = True
+        elif event in self.channel_events:
+            server = getattr(self._channels.get(data.get('channel_id')), 'server', None)
+            filtered = server is None or server.id != self.server_id
+        else:
+            filtered = not hasattr(self, 'on_' + event.lower())
+
+        if filtered:
+            self.events_filtered[event] += 1
+        else:
+            self.events_processed[event] += 1
+        return filtered
+
     # Start discord parsing
 
     def on_ready(self, data):
-        self.mind.svc_message('Connection to discord established.')
-
-        self.gateway = data.get('_trace', ('unknown gateway',))[0]
+        self.svc_message('Connection to discord established.')
 
         self.set_meta(data.get('user'))
 
+        # A READY on a live session means discord wouldn't resume it, so
+        # whatever we had is stale.
+        if self._ready is not None:
+            self._ready.stop()
+        self._held_events.clear()
+        self._drop_guilds()
+
+        # Big accounts take seconds to parse, so do it a chunk at a time and
+        # let the reactor serve everyone else in between. The guilds usually
+        # come straight out of the gateway text one at a time too, see
+        # gateway.parse_message.
+        stalls = StallMonitor(self.reactor)
+        stalls.start()
+        self._ready = task.cooperate(self._process_ready(data))
+        d = self._ready.whenDone()
+        d.addCallback(self._ready_done, stalls)
+        d.addErrback(self._ready_failed, stalls)
+
+    def _process_ready(self, data):
         for guild in data.get('guilds', []):
             unavailable = guild.get('unavailable', None)
 
             if unavailable is None or unavailable is False: # it's available!
-                server = Server(**guild)
-                server.me = property(lambda s: s.get_member(self.user.id))
-
-                self.mind.add_guild(server)
-
-                if self.server_id is None:
-                    self.server_id = server.id
-
-                if self.server_id == server.id:
-                    def join_fail(err):
-                        print(err)
-
-                    def join_success(_, s, channel):
-                        self.mind.names(self.mind.nickname, '#' + channel.name.replace(' ', '_'), [member.name.replace(' ', '_') for member in channel.members])
-                        self.mind.topic(self.mind.nickname, '#' + channel.name.replace(' ', '_'), channel.topic)
-
-                    for chan in server.channels:
-                        if str(chan.type) != 'text':
-                            continue
-                        if not chan.permissions_for(chan.server.get_member(self.id)).read_messages:
-                            continue
-                        d = self.realm.createGroup(chan.server, chan)
-                        d.addCallback(self.mind.userJoined, self.mind)
-                        d.addCallback(join_success, server, chan)
-                        d.addErrback(join_fail)
-                pass
+                for _ in self._load_guild(guild):
+                    yield
             else:
-                self._lazy_guilds = self._lazy_guilds + 1
+                # comes later in a GUILD_CREATE
+                self._lazy_guilds.add(guild['id'])
+        guild = None
+
+        # Only now, READY may still have been in the gateway text until the
+        # guilds were done with.
+        self.gateway = data.get('_trace', ('unknown gateway',))[0]
 
         for pm in data.get('private_channels', []):
-            self.mind.add_private_channel(PrivateChannel(id=pm['id'], user=DiscordUser(**pm['recipient'])))
+            self.add_private_channel(PrivateChannel(id=pm['id'], user=DiscordUser._intern(pm['recipient'])))
 
         # def join_fail(err):
         #     print(err)
@@ -394,6 +1048,411 @@ class User(DiscordClient):
         #     d.addCallback(self.mind.userJoined, self.mind)
         #     d.addErrback(join_fail)
 
+    def _load_guild(self, guild):
+        # Someone else connected may have parsed this one already
+        server = shared_guilds.acquire(guild['id'])
+        if server is None:
+            for server in self._build_server(guild):
+                yield
+            server = shared_guilds.add(server)
+            self.add_guild(server)
+        else:
+            # Ours straight away, so that the reference is handed back even
+            # if we're stopped before the end.
+            self.add_guild(server)
+            # Our READY may know members the other account's didn't, for
+            # large guilds that's at least ourselves.
+            server._pin_member(self.id)
+            members = [member for member in guild.get('members', [])
+                       if server.get_member(member['user']['id']) is None]
+            for i in range(0, len(members), self.ready_chunk_size):
+                server._add_members(members[i:i + self.ready_chunk_size])
+                yield
+            del members
+
+        server._pin_member(self.id)
+
+        if self.server_id is None:
+            self.server_id = server.id
+
+        if self.server_id == server.id:
+            for mind in self.minds[:]:
+                for _ in self._join_channels(mind, server):
+                    yield
+
+    def _join_channels(self, mind, server):
+        # Joins mind to every text channel of server we can read, yielding
+        # after each one.
+        def join_fail(err):
+            if err.check(ewords.DuplicateGroup):
+                # still there from before discord made us rebuild
+                return
+            print(err)
+
+        def join_success(_, channel):
+            mind.names(mind.nickname, '#' + channel.irc_name, self.channel_names(channel))
+            mind.topic(mind.nickname, '#' + channel.irc_name, channel.topic)
+
+        me = server.get_member(self.id)
+        if me is None:
+            # A large server parsed for some other account, we aren't
+            # loaded in it yet.
+            self.request_members(server, self.name, 1)
+            return
+
+        for chan in server.channels:
+            if str(chan.type) != 'text':
+                continue
+            if not chan.permissions_for(me).read_messages:
+                continue
+            d = mind.realm.createGroup(server, chan)
+            d.addCallback(mind.userJoined, mind)
+            d.addCallback(join_success, chan)
+            d.addErrback(join_fail)
+            yield
+
+    def channel_names(self, channel):
+        """The IRC nicks of everyone who can read channel. For large servers
+        that's only whoever is loaded, see request_members for the rest."""
+        return [irc_nick(member) for member in channel.members]
+
+    def request_members(self, server, query=u'', limit=0):
+        """Asks the gateway for members of a server that loads them on
+        demand, those starting with query or all of them. They arrive in
+        GUILD_MEMBERS_CHUNK events."""
+        if not server.lazy_members or self._protocol is None:
+            return
+        # The same request isn't repeated within member_request_interval,
+        # oldest requests are up front so expire them from there.
+        now = time()
+        while self._member_requests:
+            oldest = next(iter(self._member_requests))
+            if now - self._member_requests[oldest] < self.member_request_interval:
+                break
+            del self._member_requests[oldest]
+        key = (server.id, query.lower())
+        if key in self._member_requests:
+            return
+        self._member_requests[key] = now
+        self._protocol.send(gateway.REQUEST_GUILD_MEMBERS, {
+            'guild_id': server.id,
+            'query': query,
+            'limit': limit
+        })
+
+    def on_guild_members_chunk(self, data):
+        server = self.get_guild(data.get('guild_id'))
+        if server is None:
+            return
+        members = data.get('members', [])
+        found_me = any(member['user']['id'] == self.id for member in members)
+        server._add_members(members)
+        if found_me:
+            # _join_channels was waiting on this
+            self._sync_channels(server)
+
+    # Guild state. The parsed guilds are shared between sessions, and every
+    # session sharing one gets its own copy of these events. The first to
+    # see an event applies it and has each sharing session show the change
+    # to its IRC clients. The copies that arrive later find nothing changed.
+
+    def _sharing(self, server):
+        others = [session for session in set(sessions.values())
+                  if session is not self and session.get_guild(server.id) is server]
+        return [self] + others
+
+    def _readable(self, server, member):
+        # The text channels of server that member can read
+        return frozenset(channel for channel in server.channels
+                         if str(channel.type) == 'text' and channel.permissions_for(member).read_messages)
+
+    def _groups(self, mind, server):
+        return [group for group in mind.realm.guilds.values() if group.server.id == server.id]
+
+    def _part(self, mind, group, reason=None):
+        mind.userLeft(group, mind, reason)
+        group.remove(mind)
+        mind.realm.guilds.pop(group.name, None)
+        if group in self.groups:
+            self.groups.remove(group)
+
+    def _sync_channels(self, server):
+        """Joins or parts our IRC clients so that they're in exactly the
+        channels of the active server we can read."""
+        if server.id != self.server_id:
+            return
+        me = server.get_member(self.id)
+        readable = set(channel.id for channel in self._readable(server, me)) if me else set()
+        for mind in self.minds:
+            joined = set()
+            for group in self._groups(mind, server):
+                channel = server.get_channel(group.channel.id)
+                if channel is group.channel and channel.id in readable and group.name == channel.irc_name.lower():
+                    joined.add(group.channel.id)
+                else:
+                    self._part(mind, group)
+            if readable - joined:
+                task.cooperate(self._join_channels(mind, server))
+
+    def _show_member(self, server, member, before, after, old_prefix=None):
+        """Shows member parting the channels only in before and joining the
+        ones only in after, and a nick change if its prefix changed."""
+        if server.id != self.server_id or member.id == self.id:
+            return
+        prefix = irc_prefix(member)
+        for mind in self.minds:
+            groups = dict((group.channel.id, group) for group in self._groups(mind, server))
+            if old_prefix is not None and old_prefix != prefix and any(c.id in groups for c in before | after):
+                mind.sendMessage('NICK', irc_nick(member), prefix=old_prefix)
+            for channel in before - after:
+                if channel.id in groups:
+                    mind.part(prefix, '#' + channel.irc_name, u'leaving')
+            for channel in after - before:
+                if channel.id in groups:
+                    mind.join(prefix, '#' + channel.irc_name)
+
+    def on_guild_member_add(self, data):
+        server = self.get_guild(data.get('guild_id'))
+        if server is None or server.get_member(data['user']['id']) is not None:
+            return
+        server._add_members([data])
+        member = server.get_member(data['user']['id'])
+        after = self._readable(server, member)
+        for session in self._sharing(server):
+            session._show_member(server, member, frozenset(), after)
+
+    def on_guild_member_update(self, data):
+        server = self.get_guild(data.get('guild_id'))
+        member = server and server.get_member(data['user']['id'])
+        if member is None:
+            return
+        roles = [server.default_role]
+        for role_id in data.get('roles', []):
+            role = server.get_role(role_id)
+            if role is not None:
+                roles.append(role)
+
+        state = lambda: (irc_prefix(member), member.nick, set(role.id for role in member.roles))
+        old = state()
+        before = self._readable(server, member)
+        member._user._update(**data['user'])
+        member.nick = data.get('nick')
+        member.roles = roles
+        if state() == old:
+            return
+        server._invalidate_permissions(member)
+        after = self._readable(server, member)
+        for session in self._sharing(server):
+            if session.id == member.id:
+                session._sync_channels(server)
+            session._show_member(server, member, before, after, old[0])
+
+    def on_guild_member_remove(self, data):
+        server = self.get_guild(data.get('guild_id'))
+        member = server and server.get_member(data['user']['id'])
+        if member is None:
+            return
+        before = self._readable(server, member)
+        server._remove_member(member)
+        for session in self._sharing(server):
+            session._show_member(server, member, before, frozenset())
+
+    def on_channel_create(self, data):
+        if data.get('is_private'):
+            self.add_private_channel(PrivateChannel(id=data['id'], user=DiscordUser._intern(data['recipient'])))
+            return
+        server = self.get_guild(data.get('guild_id'))
+        if server is None:
+            return
+        if server.get_channel(data['id']) is not None:
+            return self.on_channel_update(data)
+        channel = Channel(server=server, **data)
+        server._add_channel(channel)
+        for session in self._sharing(server):
+            session._channels[channel.id] = channel
+            session._sync_channels(server)
+
+    def on_channel_update(self, data):
+        server = self.get_guild(data.get('guild_id'))
+        channel = server and server.get_channel(data['id'])
+        if channel is None:
+            return self.on_channel_create(data)
+
+        state = lambda: (channel.name, channel.topic, channel.position, channel._permission_overwrites)
+        old = state()
+        channel._update(server=server, **data)
+        if state() == old:
+            return
+        # moves the IRC name over if it was renamed
+        server._add_channel(channel)
+        for session in self._sharing(server):
+            session._channel_updated(server, channel, old[1])
+
+    def _channel_updated(self, server, channel, old_topic):
+        if server.id != self.server_id:
+            return
+        for mind in self.minds:
+            for group in self._groups(mind, server):
+                if group.channel.id != channel.id:
+                    continue
+                if group.name != channel.irc_name.lower():
+                    # IRC channels can't be renamed, part the old name and
+                    # let _sync_channels join the new one
+                    self._part(mind, group, u'renamed to #' + channel.irc_name)
+                elif channel.topic != old_topic:
+                    group.meta['topic'] = channel.topic
+                    mind.topic(mind.nickname, '#' + channel.irc_name, channel.topic, 'discord')
+        self._sync_channels(server)
+
+    def on_channel_delete(self, data):
+        if data.get('is_private'):
+            channel = self.get_private_channel(data['id'])
+            if channel is not None:
+                self.remove_private_channel(channel)
+            return
+        server = self.get_guild(data.get('guild_id'))
+        channel = server and server.get_channel(data['id'])
+        if channel is None:
+            return
+        server._remove_channel(channel)
+        for session in self._sharing(server):
+            session._channels.pop(channel.id, None)
+            session._sync_channels(server)
+
+    def on_guild_role_create(self, data):
+        server = self.get_guild(data.get('guild_id'))
+        if server is None:
+            return
+        if server.get_role(data['role']['id']) is not None:
+            return self.on_guild_role_update(data)
+        # A new role has no members yet, so nobody can see anything new
+        server._add_role(Role(server=server, **data['role']))
+
+    def on_guild_role_update(self, data):
+        server = self.get_guild(data.get('guild_id'))
+        role = server and server.get_role(data['role']['id'])
+        if role is None:
+            return self.on_guild_role_create(data)
+        role._update(**data['role'])
+        # Other members' channels may have changed too, but walking every
+        # member for that isn't worth it, NAMES is up to date either way.
+        for session in self._sharing(server):
+            session._sync_channels(server)
+
+    def on_guild_role_delete(self, data):
+        server = self.get_guild(data.get('guild_id'))
+        role = server and server.get_role(data['role_id'])
+        if role is None:
+            return
+        for member in server.members:
+            if role in member.roles:
+                member.roles.remove(role)
+        server._remove_role(role)
+        for session in self._sharing(server):
+            session._sync_channels(server)
+
+    def on_guild_create(self, data):
+        # Whether it's a guild from READY becoming available or one we just
+        # joined, it's ours alone to load, sessions sharing the guild get
+        # their own GUILD_CREATE if their account is in it.
+        guild_id = data['id']
+        if data.get('unavailable') or guild_id in self._loading or self.get_guild(guild_id) is not None:
+            return
+        self._lazy_guilds.discard(guild_id)
+        # Until it's loaded, events for it are held back, see dispatch
+        self._loading[guild_id] = []
+        for channel in data.get('channels', []):
+            self._loading_channels[channel['id']] = guild_id
+        loader = self._loaders[guild_id] = task.cooperate(self._load_guild(data))
+        d = loader.whenDone()
+        d.addErrback(self._guild_load_failed, guild_id)
+        d.addCallback(lambda _: self._guild_loaded(guild_id))
+
+    def _guild_load_failed(self, err, guild_id):
+        if not err.check(task.TaskStopped):
+            log.err(err, 'Loading guild {} failed'.format(guild_id))
+
+    def _guild_loaded(self, guild_id):
+        self._loaders.pop(guild_id, None)
+        held = self._loading.pop(guild_id, None)
+        if held is None:
+            return # dropped while it loaded
+        for channel_id, loading in self._loading_channels.items():
+            if loading == guild_id:
+                del self._loading_channels[channel_id]
+        for event, data in held:
+            self.dispatch(event, data)
+
+    def on_guild_delete(self, data):
+        server = self.get_guild(data['id'])
+        if server is None:
+            return
+        outage = data.get('unavailable', False)
+        if outage:
+            # it comes back with a GUILD_CREATE, and stays the active
+            # server if it was
+            self._lazy_guilds.add(server.id)
+        elif server.id == self.server_id:
+            self.svc_message('You are no longer in {}.'.format(server.name))
+            self.server_id = None
+        for mind in self.minds:
+            for group in self._groups(mind, server):
+                self._part(mind, group)
+        self.remove_guild(server)
+
+    def _build_server(self, guild):
+        # Yields while it works through the members and presences, the last
+        # thing it yields is the finished server.
+        members = guild.pop('members', [])
+        presences = guild.pop('presences', [])
+        voice_states = guild.pop('voice_states', [])
+        server = Server(**guild)
+        if server.large and self.member_cache_size:
+            server._limit_members(self.member_cache_size)
+            server._pin_member(self.id)
+        yield
+
+        for i in range(0, len(members), self.ready_chunk_size):
+            server._add_members(members[i:i + self.ready_chunk_size])
+            yield
+        del members
+
+        for i in range(0, len(presences), self.ready_chunk_size):
+            server._update_presences(presences[i:i + self.ready_chunk_size])
+            yield
+        del presences
+
+        for obj in voice_states:
+            server._update_voice_state(obj)
+        yield server
+
+    def _ready_done(self, _, stalls):
+        self._ready = None
+        self.ready_stall = stalls.stop()
+        log.msg('READY for {} processed, longest reactor stall {:.3f}s, {} events held meanwhile, {}'.format(
+            self.name, self.ready_stall, len(self._held_events), self.transport_stats()))
+        self._release_events()
+
+    def _ready_failed(self, err, stalls):
+        self._ready = None
+        self.ready_stall = stalls.stop()
+        if err.check(task.TaskStopped):
+            # a newer READY or logging out, the held events are stale
+            self._held_events.clear()
+            return
+        log.err(err, 'Processing READY for {} failed'.format(self.name))
+        self._release_events()
+
+    def _release_events(self):
+        held, self._held_events = self._held_events, deque()
+        for event, data in held:
+            self.dispatch(event, data)
+
+    def disconnect(self, reason):
+        if self._ready is not None:
+            self._ready.stop()
+        return DiscordClient.disconnect(self, reason)
+
     def change_nick(self, nick, password):
         payload = {
             'username': nick,
@@ -405,32 +1464,33 @@ class User(DiscordClient):
         def handle_success(body):
             self.set_meta(json.loads(body))
 
-        d = chord.http_patch('https://discordapp.com/api/users/@me', self.credentials.token, payload)
+        d = self.rest.patch('/users/@me', payload)
         d.addCallback(handle_success)
         return d
 
     def update_user(self, presence):
         pass
 
-    def on_typing_start(self, data):
-        # Literally unused
-        pass
-
-    def on_presence_update(self, data):
-        # Unused atm
-        pass
-
     def on_user_update(self, data):
-        self.mind.svc_message(repr(data))
+        self.svc_message(repr(data))
 
     def on_message_create(self, data):
-        channel = self.mind.get_channel(data.get('channel_id'))
+        channel = self.get_channel(data.get('channel_id'))
         nonce = data.get('nonce', None)
-        if nonce in self._sent_nonces:
-            self._sent_nonces.remove(nonce)
+        pending = self._pending_sends.pop(nonce) if nonce is not None else None
+        if pending is not None:
+            if pending.received is not None:
+                self._record_latency('echoed', pending.channel_id, self.reactor.seconds() - pending.received)
+            outbound.delivered(nonce)
             return # We've already got this message in our client
-        if (channel and channel.server.id == self.server_id):
-            message = Message(channel=channel, **data)
-            sender = '{}!{}@discord.gg'.format(unidecode(message.author.name).replace(' ', '_'), message.author.discriminator)
-            for line in message.clean_content.split('\n'):
-                self.mind.privmsg(sender, '#' + channel.name.replace(' ', '_'), line)
+        message = Message(channel=channel, **data)
+        server = channel.server
+        if server.lazy_members:
+            # Load whoever we couldn't resolve, for the next time they speak
+            # or get mentioned
+            for user in [data.get('author', {})] + data.get('mentions', []):
+                if server.get_member(user.get('id')) is None:
+                    self.request_members(server, user.get('username', u''), 10)
+        sender = irc_prefix(message.author)
+        for line in message.clean_content.split('\n'):
+            self._privmsg(sender, '#' + channel.irc_name, line)
@@ -0,0 +1,302 @@
+import json
+import re
+import urlparse
+
+from collections import deque
+from email.utils import parsedate_tz, mktime_tz
+from StringIO import StringIO
+
+from twisted.internet import defer
+from twisted.python import failure
+from twisted.web.client import Agent, FileBodyProducer, HTTPConnectionPool, readBody
+from twisted.web.http_headers import Headers
+
+import chord
+
+API = 'https://discordapp.com/api'
+USER_AGENT = 'DiscordBot (https://github.com/maxpowa/drawbridge, 0.1)'
+_API_HOST = urlparse.urlsplit(API).netloc
+
+# IDs in a path share a bucket, apart from the channel or guild the route
+# is for, which gets a bucket of its own.
+_minor_ids = re.compile(r'(?<!^/channels/)(?<!^/guilds/)\b[0-9]{15,}\b')
+
+
+class ConnectionPool(HTTPConnectionPool):
+    """Keeps connections to discord alive between requests, and counts how
+    often one got reused rather than opened (with a TLS handshake).
+
+    The pool itself only limits how many idle connections it keeps, so it
+    also hands out a semaphore per host that RESTClient holds for every
+    request in flight. That caps the connections open to a host at
+    max_connections."""
+    def __init__(self, reactor, max_connections=4):
+        HTTPConnectionPool.__init__(self, reactor, persistent=True)
+        self.requests = 0
+        self.opened = 0
+        self._limits = {}
+        self.set_max_connections(max_connections)
+
+    def set_max_connections(self, max_connections):
+        self.max_connections = max_connections
+        self.maxPersistentPerHost = max_connections
+        for limit in self._limits.values():
+            limit.tokens += max_connections - limit.limit
+            limit.limit = max_connections
+
+    def limit(self, host):
+        """The semaphore a request to host holds for as long as it uses a
+        connection."""
+        limit = self._limits.get(host)
+        if limit is None:
+            limit = self._limits[host] = defer.DeferredSemaphore(self.max_connections)
+        return limit
+
+    @property
+    def reused(self):
+        return self.requests - self.opened
+
+    def getConnection(self, key, endpoint):
+        self.requests += 1
+        return HTTPConnectionPool.getConnection(self, key, endpoint)
+
+    def _newConnection(self, key, endpoint):
+        self.opened += 1
+        return HTTPConnectionPool._newConnection(self, key, endpoint)
+
+    def stats(self):
+        return '{} requests, {} over a reused connection, {} new connections'.format(
+            self.requests, self.reused, self.opened)
+
+
+_pool = None
+
+def connection_pool(reactor=None):
+    """The pool all of drawbridge's REST traffic shares."""
+    global _pool
+    if _pool is None:
+        if reactor is None:
+            from twisted.internet import reactor
+        _pool = ConnectionPool(reactor)
+    return _pool
+
+
+class HTTPError(Exception):
+    def __init__(self, code, body):
+        Exception.__init__(self, '{} {}'.format(code, body))
+        self.code = code
+        self.body = body
+
+
+class Bucket(object):
+    """One of discord's rate limit buckets. Requests wait in its queue until
+    the bucket has room for them."""
+    def __init__(self, key):
+        self.key = key
+        # Until discord tells us the limits, one request at a time
+        self.remaining = 1
+        self.reset_at = 0.0
+        self.queue = deque()
+        self.in_flight = 0
+        self._pump = None
+
+
+class RESTClient(object):
+    """Talks to the discord REST API for one token, holding requests back
+    per bucket so that they go out as fast as discord allows but don't run
+    into 429s.
+
+    Wait times are how long requests sat in a queue before going out.
+    """
+
+    # Longest 429 cooldown worth waiting out, anything longer fails with
+    # RateLimitError (changing your username, for one, is limited per hour)
+    max_retry_after = 60
+
+    def __init__(self, token, reactor=None):
+        if reactor is None:
+            from twisted.internet import reactor
+
+        self.token = token
+        self.reactor = reactor
+        self.pool = connection_pool(reactor)
+        self.agent = Agent(reactor, pool=self.pool)
+        self.buckets = {}
+        self._global_reset = 0.0
+
+        self.sent = 0
+        self.rate_limited = 0
+        self.max_depth = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def get(self, path):
+        return self.request('GET', path)
+
+    def post(self, path, payload):
+        return self.request('POST', path, payload)
+
+    def patch(self, path, payload):
+        return self.request('PATCH', path, payload)
+
+    def delete(self, path):
+        return self.request('DELETE', path)
+
+    def request(self, method, path, payload=None):
+        """Queues a request and returns a Deferred firing with the response
+        body once it's been made."""
+        key = method + ' ' + _minor_ids.sub('{id}', path)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = Bucket(key)
+
+        d = defer.Deferred()
+        bucket.queue.append((method, path, payload, d, self.reactor.seconds()))
+        self.max_depth = max(self.max_depth, len(bucket.queue))
+        self._pump(bucket)
+        return d
+
+    @property
+    def queue_depth(self):
+        return sum(len(bucket.queue) for bucket in self.buckets.values())
+
+    def stats(self):
+        average = self.wait_total / self.sent if self.sent else 0.0
+        return ('{} requests sent, {} queued (at most {}), {} rate limited, '
+                'waited {:.3f}s on average and {:.3f}s at most').format(
+            self.sent, self.queue_depth, self.max_depth, self.rate_limited, average, self.wait_max)
+
+    def _pump(self, bucket):
+        if bucket._pump is not None and bucket._pump.active():
+            bucket._pump.cancel()
+        bucket._pump = None
+        now = self.reactor.seconds()
+        reset_at = max(bucket.reset_at, self._global_reset)
+        if now >= bucket.reset_at and bucket.remaining <= 0 and not bucket.in_flight:
+            # the window is over, but we only find out the new limits from
+            # the next response, so send one and see
+            bucket.remaining = 1
+
+        while bucket.queue and now >= self._global_reset and bucket.remaining > 0:
+            method, path, payload, d, queued = bucket.queue.popleft()
+            bucket.remaining -= 1
+            self._send(bucket, method, path, payload, d, queued)
+
+        if bucket.queue and not bucket.in_flight:
+            bucket._pump = self.reactor.callLater(max(reset_at - now, 0), self._pump, bucket)
+
+    def _send(self, bucket, method, path, payload, d, queued):
+        waited = self.reactor.seconds() - queued
+        self.sent += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+
+        headers = Headers({'User-Agent': [USER_AGENT]})
+        if self.token is not None:
+            headers.addRawHeader('Authorization', self.token)
+        body = None
+        if payload is not None:
+            headers.addRawHeader('Content-Type', 'application/json')
+            body = FileBodyProducer(StringIO(json.dumps(payload)))
+
+        bucket.in_flight += 1
+        limit = self.pool.limit(_API_HOST)
+        r = limit.acquire()
+        r.addCallback(lambda _: self.agent.request(method, API + path, headers, body))
+        r.addCallbacks(self._response, self._failed,
+                       callbackArgs=(bucket, method, path, payload, d, queued),
+                       errbackArgs=(bucket, d))
+        # the connection is free again once the body has been read
+        r.addBoth(lambda _: limit.release())
+
+    def _response(self, response, bucket, method, path, payload, d, queued):
+        bucket.in_flight -= 1
+        now = self.reactor.seconds()
+        self._update_limits(bucket, response.headers, now)
+
+        def got_body(body):
+            if response.code == 429:
+                retry_after = self._retry_after(response.headers, body)
+                if retry_after <= self.max_retry_after:
+                    # put it back up front and try again once it's over
+                    self.rate_limited += 1
+                    reset_at = now + retry_after
+                    if response.headers.hasHeader('X-RateLimit-Global'):
+                        self._global_reset = reset_at
+                    bucket.remaining = 0
+                    bucket.reset_at = reset_at
+                    bucket.queue.appendleft((method, path, payload, d, queued))
+                    self._pump(bucket)
+                    return
+                d.errback(failure.Failure(chord.errors.RateLimitError(body)))
+            elif response.code == 401:
+                d.errback(failure.Failure(chord.errors.LoginError(body)))
+            elif response.code >= 400:
+                d.errback(failure.Failure(HTTPError(response.code, body)))
+            else:
+                d.callback(body)
+            self._pump(bucket)
+
+        b = readBody(response)
+        b.addCallback(got_body)
+        b.addErrback(self._failed, None, d)
+        return b
+
+    def _failed(self, err, bucket, d):
+        if bucket is not None:
+            bucket.in_flight -= 1
+            self._pump(bucket)
+        d.errback(err)
+
+    def _update_limits(self, bucket, headers, now):
+        remaining = headers.getRawHeaders('X-RateLimit-Remaining')
+        if remaining is None:
+            return
+        bucket.remaining = int(remaining[0]) - bucket.in_flight
+        reset_after = headers.getRawHeaders('X-RateLimit-Reset-After')
+        reset = headers.getRawHeaders('X-RateLimit-Reset')
+        if reset_after is not None:
+            bucket.reset_at = now + float(reset_after[0])
+        elif reset is not None:
+            # an epoch timestamp by discord's clock, which is what Date is in
+            date = headers.getRawHeaders('Date')
+            server_now = mktime_tz(parsedate_tz(date[0])) if date else now
+            bucket.reset_at = now + max(float(reset[0]) - server_now, 0)
+
+    def _retry_after(self, headers, body):
+        try:
+            # milliseconds in the body
+            return json.loads(body)['retry_after'] / 1000.0
+        except (ValueError, KeyError, TypeError):
+            retry_after = headers.getRawHeaders('Retry-After')
+            return float(retry_after[0]) if retry_after else 1.0
+
+
+# Logging in, which happens before there's a session to hang a RESTClient on
+
+def check_token(token):
+    """Fires with token if discord accepts it."""
+    d = RESTClient(token).get('/users/@me')
+    d.addCallback(lambda _: token)
+    return d
+
+def get_user_for_token(token):
+    """Fires with the user the token belongs to."""
+    d = RESTClient(token).get('/users/@me')
+    d.addCallback(json.loads)
+    return d
+
+def get_token(email, password):
+    """Logs in with email and password and fires with the token."""
+    def bad_login(err):
+        err.trap(HTTPError)
+        if err.value.code != 400:
+            return err
+        raise chord.errors.LoginError(err.value.body)
+
+    d = RESTClient(None).post('/auth/login', {'email': email, 'password': password})
+    d.addCallbacks(lambda body: json.loads(body)['token'], bad_login)
+    return d
+
+def invalidate_token(token):
+    return RESTClient(token).post('/auth/logout', {'token': token})
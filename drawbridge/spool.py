@@ -0,0 +1,191 @@
+import json
+import os
+
+from collections import OrderedDict
+from random import uniform
+
+from twisted.internet import defer
+from twisted.python import log
+
+import chord
+from rest import HTTPError
+
+
+class Entry(object):
+    """A message on its way to discord."""
+    def __init__(self, nonce, user_id, channel_id, content):
+        self.nonce = nonce
+        self.user_id = user_id
+        self.channel_id = channel_id
+        self.content = content
+        self.attempts = 0
+        self.session = None
+        self.timer = None
+        self.accepted = None
+        self.deferred = defer.Deferred()
+
+    def record(self):
+        return {'nonce': self.nonce, 'user': self.user_id,
+                'channel': self.channel_id, 'content': self.content}
+
+
+class Spool(object):
+    """Messages sent from IRC that discord hasn't accepted yet.
+
+    Failed sends are retried with jittered exponential backoff, reusing
+    the message nonce so that an attempt which did go through is recognised
+    when its gateway echo shows up. With a path the spool is also kept in an
+    append-only file, so messages still queued when drawbridge stops are
+    sent the next time their account logs in. The file is emptied whenever
+    nothing is pending, and rewritten once it has grown by compact_size
+    bytes with messages that are long gone.
+    """
+
+    max_attempts = 6
+    base_delay = 1.0
+    max_delay = 60.0
+    compact_size = 1 << 20
+
+    def __init__(self):
+        self.pending = OrderedDict()
+        self.retried = 0
+        self.failed = 0
+        self._path = None
+        self._file = None
+        self._compacted = 0
+
+    def __len__(self):
+        return len(self.pending)
+
+    def open(self, path):
+        """Loads whatever was still queued in path and keeps appending to
+        it from here on."""
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue # cut short by a crash
+                    if 'done' in record:
+                        self.pending.pop(record['done'], None)
+                    else:
+                        entry = Entry(record['nonce'], record['user'], record['channel'], record['content'])
+                        self.pending[entry.nonce] = entry
+        self._path = path
+        self._compact()
+
+    def _compact(self):
+        # Start the file over with just what's still pending
+        if self._file is not None:
+            self._file.close()
+        with open(self._path + '.tmp', 'w') as f:
+            for entry in self.pending.values():
+                f.write(json.dumps(entry.record()) + '\n')
+        os.rename(self._path + '.tmp', self._path)
+        self._file = open(self._path, 'a')
+        self._compacted = os.path.getsize(self._path)
+
+    def _write(self, record):
+        if self._file is not None:
+            self._file.write(json.dumps(record) + '\n')
+            self._file.flush()
+
+    def send(self, session, channel_id, content, nonce, accepted=None):
+        """Sends content to channel_id for session. The Deferred fires once
+        discord has taken the message, with the response or with None if
+        the gateway echo came first, and fails when it gave up on it.
+        accepted is called with the response whenever the REST post goes
+        through, even after the echo."""
+        entry = Entry(unicode(nonce), session.id, channel_id, content)
+        entry.accepted = accepted
+        self.pending[entry.nonce] = entry
+        self._write(entry.record())
+        entry.session = session
+        self._attempt(entry)
+        return entry.deferred
+
+    def resume(self, session):
+        """Sends whatever was left over for session's account from before a
+        restart."""
+        for entry in self.pending.values():
+            if entry.session is None and entry.user_id == session.id:
+                entry.session = session
+                session._pending_sends.add(entry.nonce)
+                self._attempt(entry)
+
+    def delivered(self, nonce):
+        """The gateway echoed nonce, so one of the attempts went through."""
+        entry = self.pending.get(nonce)
+        if entry is not None:
+            self._done(entry, None)
+
+    def _attempt(self, entry):
+        entry.timer = None
+        entry.attempts += 1
+        payload = {
+            'content': entry.content,
+            'nonce': entry.nonce
+        }
+        d = entry.session.rest.post('/channels/{}/messages'.format(entry.channel_id), payload)
+        d.addCallbacks(self._sent, self._error, callbackArgs=(entry,), errbackArgs=(entry,))
+
+    def _sent(self, result, entry):
+        if entry.accepted is not None:
+            entry.accepted(result)
+        self._done(entry, result)
+
+    def _error(self, err, entry):
+        if entry.nonce not in self.pending:
+            return # the echo beat the error here, it got through
+
+        if self._retryable(err) and entry.attempts < self.max_attempts:
+            self.retried += 1
+            delay = min(self.max_delay, self.base_delay * 2 ** (entry.attempts - 1))
+            entry.timer = entry.session.reactor.callLater(delay * uniform(0.5, 1.5), self._attempt, entry)
+            return
+
+        self.failed += 1
+        channel = entry.session.get_channel(entry.channel_id)
+        where = '#' + channel.irc_name if channel is not None else 'discord'
+        preview = entry.content if len(entry.content) <= 60 else entry.content[:57] + u'...'
+        entry.session.svc_message(u'Your message to {} could not be delivered ({}): {}'.format(
+            where, err.getErrorMessage(), preview))
+        log.msg('Giving up on message {} after {} attempts: {}'.format(entry.nonce, entry.attempts, err.getErrorMessage()))
+        if self._finish(entry):
+            entry.deferred.errback(err)
+
+    def _retryable(self, err):
+        if err.check(HTTPError):
+            return err.value.code >= 500
+        # Bad tokens and long cooldowns aren't going to get better
+        return not err.check(chord.errors.LoginError, chord.errors.RateLimitError)
+
+    def _done(self, entry, result):
+        # the echo and the REST response both end up here, whichever is
+        # second has nothing left to do
+        if self._finish(entry):
+            entry.deferred.callback(result)
+
+    def _finish(self, entry):
+        """Takes entry out of the spool, returns False if it already was."""
+        if self.pending.pop(entry.nonce, None) is None:
+            return False
+        if entry.timer is not None and entry.timer.active():
+            entry.timer.cancel()
+        if self._file is None:
+            return True
+        if not self.pending:
+            # nothing left that a restart would need
+            self._file.seek(0)
+            self._file.truncate()
+            self._compacted = 0
+        else:
+            self._write({'done': entry.nonce})
+            if self._file.tell() - self._compacted > self.compact_size:
+                self._compact()
+        return True
+
+
+# Shared by every session in the process
+outbound = Spool()
@@ -0,0 +1,215 @@
+import json
+import zlib
+
+from twisted.internet import defer, error, protocol, reactor, task
+from twisted.python import failure
+from twisted.trial import unittest
+
+import gateway
+from realm import User
+
+
+class RecordingProtocol(gateway.GatewayProtocol):
+    """A gateway connection that keeps what would go over the wire."""
+    def __init__(self, factory):
+        self.factory = factory
+        self.sent = []
+        self.dropped = False
+
+    def sendMessage(self, payload, isBinary=False):
+        self.sent.append(json.loads(payload))
+
+    def sendClose(self, code=None, reason=None):
+        self.closed = (code, reason)
+
+    def dropConnection(self, abort=False):
+        self.dropped = True
+
+
+class FakeFactory(object):
+    def __init__(self, client, reactor):
+        self.client = client
+        self.reactor = reactor
+
+
+class ParseMessageTests(unittest.TestCase):
+    def test_plain_message(self):
+        msg = gateway.parse_message('{"op": 0, "t": "MESSAGE_CREATE", "s": 3, "d": {"content": "hi"}}')
+        self.assertEqual(msg, {'op': 0, 't': 'MESSAGE_CREATE', 's': 3, 'd': {'content': 'hi'}})
+
+    def test_ready_guilds_are_decoded_lazily(self):
+        text = json.dumps({'t': 'READY', 'op': 0, 's': 1})[:-1] + \
+            ', "d": {"user": {"id": "1"}, "session_id": "abc", "guilds": [{"id": "1"}, {"id": "2"}], ' \
+            '"private_channels": [{"id": "9"}]}}'
+        msg = gateway.parse_message(text)
+        data = msg['d']
+        self.assertEqual(data['session_id'], 'abc')
+        self.assertNotIsInstance(data['guilds'], list)
+        self.assertNotIn('private_channels', data)
+        self.assertEqual([guild['id'] for guild in data['guilds']], ['1', '2'])
+        # whatever came after the guilds is there once they've been iterated
+        self.assertEqual(data['private_channels'], [{'id': '9'}])
+
+    def test_ready_with_guilds_first_decodes_eagerly(self):
+        text = '{"t": "READY", "op": 0, "s": 1, "d": {"guilds": [{"id": "1"}], "session_id": "abc", "user": {}}}'
+        msg = gateway.parse_message(text)
+        self.assertEqual(msg['d']['guilds'], [{'id': '1'}])
+
+
+class SessionTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.user = User(u'me', reactor=self.clock)
+        self.user._token = 'token'
+        self.reconnects = []
+        self.user.connect = self.reconnects.append
+        self.user._gateway_url = 'wss://gateway'
+        self.notices = []
+        self.user.svc_message = self.notices.append
+
+    def connection(self):
+        return RecordingProtocol(FakeFactory(self.user, self.clock))
+
+    def hello(self, protocol):
+        protocol.handle_payload({'op': gateway.HELLO, 'd': {'heartbeat_interval': 41250}})
+        self.addCleanup(protocol.stop_heartbeat)
+
+    def test_identifies_without_session(self):
+        protocol = self.connection()
+        self.hello(protocol)
+        self.assertEqual([msg['op'] for msg in protocol.sent], [gateway.IDENTIFY])
+
+    def test_resumes_after_dropped_connection(self):
+        protocol = self.connection()
+        self.hello(protocol)
+        self.user.session_id = 'abc'
+        protocol.handle_payload({'op': gateway.DISPATCH, 't': 'TYPING_START', 's': 7, 'd': {}})
+
+        # the connection drops mid-stream
+        protocol.onClose(False, 1006, 'connection lost')
+        self.assertEqual(self.reconnects, [])
+        self.clock.advance(self.user.reconnect_delay)
+        self.assertEqual(self.reconnects, ['wss://gateway'])
+
+        protocol = self.connection()
+        self.hello(protocol)
+        self.assertEqual(protocol.sent[-1], {'op': gateway.RESUME, 'd': {
+            'token': 'token', 'session_id': 'abc', 'seq': 7}})
+        protocol.handle_payload({'op': gateway.DISPATCH, 't': 'TYPING_START', 's': 8, 'd': {}})
+        protocol.handle_payload({'op': gateway.DISPATCH, 't': 'RESUMED', 's': 9, 'd': {}})
+        self.assertEqual(self.notices[-1], 'Discord session resumed, 1 missed events replayed.')
+
+    def test_session_close_code_starts_over(self):
+        protocol = self.connection()
+        self.hello(protocol)
+        self.user.session_id = 'abc'
+        protocol.onClose(False, 4009, 'session timed out')
+        self.clock.advance(self.user.reconnect_delay)
+
+        protocol = self.connection()
+        self.hello(protocol)
+        self.assertEqual(protocol.sent[-1]['op'], gateway.IDENTIFY)
+
+    def test_fatal_close_code_does_not_reconnect(self):
+        protocol = self.connection()
+        self.hello(protocol)
+        protocol.onClose(False, 4004, 'authentication failed')
+        self.clock.advance(60)
+        self.assertEqual(self.reconnects, [])
+
+    def test_resumable_invalid_session_resumes(self):
+        self.user.session_id = 'abc'
+        self.user.seq = 3
+        protocol = self.connection()
+        self.hello(protocol)
+        protocol.handle_payload({'op': gateway.INVALID_SESSION, 'd': True})
+        self.clock.advance(5)
+        self.assertEqual([msg['op'] for msg in protocol.sent], [gateway.RESUME, gateway.RESUME])
+        self.assertEqual(self.user.session_id, 'abc')
+
+    def test_invalid_session_identifies(self):
+        self.user.session_id = 'abc'
+        protocol = self.connection()
+        self.hello(protocol)
+        protocol.handle_payload({'op': gateway.INVALID_SESSION, 'd': False})
+        self.clock.advance(5)
+        self.assertEqual([msg['op'] for msg in protocol.sent], [gateway.RESUME, gateway.IDENTIFY])
+        self.assertIdentical(self.user.session_id, None)
+
+    def test_invalid_session_on_closed_connection(self):
+        protocol = self.connection()
+        self.hello(protocol)
+        protocol.handle_payload({'op': gateway.INVALID_SESSION, 'd': False})
+        protocol.onClose(False, 1006, 'connection lost')
+        self.clock.advance(5)
+        self.assertEqual([msg['op'] for msg in protocol.sent], [gateway.IDENTIFY])
+
+    def test_disconnect_closes_with_unicode_reason(self):
+        protocol = self.connection()
+        self.hello(protocol)
+        self.user.disconnect(failure.Failure(Exception('connection lost')))
+        self.assertEqual(protocol.closed, (1000, u'Logged out'))
+        self.assertIsInstance(protocol.closed[1], unicode)
+
+    def test_refused_connection_is_retried(self):
+        # a port nothing listens on any more
+        port = reactor.listenTCP(0, protocol.ServerFactory(), interface='127.0.0.1')
+        url = 'ws://127.0.0.1:{}'.format(port.getHost().port)
+        d = port.stopListening()
+
+        failed = defer.Deferred()
+        def gateway_failed(reason):
+            User.gateway_failed(self.user, reason)
+            failed.callback(reason.value)
+        self.user.gateway_failed = gateway_failed
+        d.addCallback(lambda _: gateway.connect(self.user, url, reactor, compress=False))
+        d.addCallback(lambda _: failed)
+
+        def check(reason):
+            self.assertIsInstance(reason, error.ConnectionRefusedError)
+            self.assertIn('Could not connect to discord', self.notices[-1])
+            self.clock.advance(self.user.reconnect_delay)
+            self.assertEqual(self.reconnects, ['wss://gateway'])
+        return d.addCallback(check)
+
+    def next_reconnect(self):
+        calls = [call for call in self.clock.getDelayedCalls() if call.func == self.user.connect]
+        self.assertEqual(len(calls), 1)
+        return calls[0].getTime() - self.clock.seconds()
+
+    def test_reconnects_back_off(self):
+        refused = failure.Failure(error.ConnectionRefusedError())
+        delays = []
+        for attempt in range(8):
+            self.user.gateway_failed(refused)
+            delays.append(self.next_reconnect())
+            self.clock.advance(delays[-1])
+        self.assertEqual(delays, [5, 10, 20, 40, 80, 160, 300, 300])
+        self.assertEqual(len(self.reconnects), 8)
+
+        # a connection that gets through starts over
+        self.hello(self.connection())
+        self.user.gateway_failed(refused)
+        self.assertEqual(self.next_reconnect(), 5)
+
+    def test_unacknowledged_heartbeat_drops_connection(self):
+        protocol = self.connection()
+        self.hello(protocol)
+        self.clock.advance(41.25)
+        self.assertEqual(protocol.sent[-1]['op'], gateway.HEARTBEAT)
+        self.assertFalse(protocol.dropped)
+        self.clock.advance(41.25)
+        self.assertTrue(protocol.dropped)
+
+    def test_zlib_stream_split_over_frames(self):
+        protocol = self.connection()
+        seen = []
+        protocol.handle_payload = seen.append
+        deflate = zlib.compressobj()
+        for s in (1, 2):
+            data = deflate.compress(json.dumps({'op': 0, 't': 'TYPING_START', 's': s, 'd': {}}))
+            data += deflate.flush(zlib.Z_SYNC_FLUSH)
+            protocol.onMessage(data[:5], True)
+            self.assertEqual(len(seen), s - 1)
+            protocol.onMessage(data[5:], True)
+        self.assertEqual([msg['s'] for msg in seen], [1, 2])
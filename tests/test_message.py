@@ -0,0 +1,70 @@
+from twisted.trial import unittest
+
+import discord
+
+
+def server():
+    return discord.Server(
+        id='1', name=u'guild', owner_id='10',
+        roles=[{'id': '1', 'name': u'@everyone', 'permissions': 0x400},
+               {'id': '1000', 'name': u'staff', 'permissions': 0}],
+        members=[{'user': {'id': '10', 'username': u'alice', 'discriminator': '0001'}, 'roles': []},
+                 {'user': {'id': '11', 'username': u'bob', 'discriminator': '0002'}, 'roles': ['1000'],
+                  'nick': u'bobby'}],
+        channels=[{'id': '100', 'name': u'general', 'type': 'text', 'permission_overwrites': []}])
+
+
+class CleanContentTests(unittest.TestCase):
+    def clean(self, content, mentions=(), mention_roles=()):
+        guild = server()
+        message = discord.Message(channel=guild.get_channel('100'), id='1', content=content,
+                                  author={'id': '10', 'username': u'alice', 'discriminator': '0001'},
+                                  mentions=[{'id': user_id} for user_id in mentions],
+                                  mention_roles=list(mention_roles))
+        return message.clean_content
+
+    def test_user_mentions(self):
+        self.assertEqual(self.clean(u'hi <@10>', ['10']), u'hi @alice')
+        # the ! form is used for members with a nick
+        self.assertEqual(self.clean(u'hi <@!11> and <@11>', ['11']), u'hi @bobby and @bobby')
+
+    def test_role_mention(self):
+        self.assertEqual(self.clean(u'<@&1000> look', mention_roles=['1000']), u'@staff look')
+
+    def test_channel_mention(self):
+        self.assertEqual(self.clean(u'see <#100>'), u'see #general')
+
+    def test_unresolved_left_alone(self):
+        # not in mentions, no such role or channel
+        self.assertEqual(self.clean(u'<@10> <@!12> <@&999> <#999>'), u'<@10> <@!12> <@&999> <#999>')
+
+    def test_everyone_and_here(self):
+        self.assertEqual(self.clean(u'@everyone @here'), u'@\u200beveryone @\u200bhere')
+
+    def test_adjacent_and_malformed(self):
+        self.assertEqual(self.clean(u'<@10><#100><@&1000> <@x> <#> <@!!10>', ['10'], ['1000']),
+                         u'@alice#general@staff <@x> <#> <@!!10>')
+
+
+class AuthorTests(unittest.TestCase):
+    def test_member_and_author_share_a_user(self):
+        guild = server()
+        member = guild.get_member('11')
+        message = discord.Message(channel=guild.get_channel('100'), id='1', content=u'hi',
+                                  author={'id': '11', 'username': u'bob', 'discriminator': '0002'})
+        # in the guild the author is the member
+        self.assertIdentical(message.author, member)
+        # out of it, their User
+        private = discord.Message(channel_id='200', id='2', content=u'hi',
+                                  author={'id': '11', 'username': u'bob', 'discriminator': '0002'})
+        self.assertIdentical(private.author, member._user)
+
+        # a later message carries a new name, the member sees it too
+        discord.Message(channel_id='200', id='3', content=u'hi',
+                        author={'id': '11', 'username': u'robert', 'discriminator': '0002'})
+        self.assertEqual(member.name, u'robert')
+        self.assertEqual(private.author.name, u'robert')
+
+        # and the other way around
+        member._user._update(username=u'bob', avatar='abc')
+        self.assertEqual((private.author.name, private.author.avatar), (u'bob', 'abc'))
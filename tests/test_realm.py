@@ -0,0 +1,329 @@
+import copy
+
+from twisted.internet import task
+from twisted.trial import unittest
+from twisted.words import iwords
+from zope.interface import implementer
+
+import realm
+import spool
+from rest import HTTPError
+from test_spool import ScriptedREST
+from cache import shared_guilds
+
+
+@implementer(iwords.IChatClient)
+class FakeClient(object):
+    """An IRC client that keeps every call made on it."""
+    nickname = 'me'
+    name = 'me'
+
+    def __init__(self):
+        self.realm = realm.DiscordWordsRealm('discord.gg')
+        self.calls = []
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return lambda *args, **kwargs: self.calls.append((name,) + args)
+
+    def take(self, *names):
+        """The calls named so far, forgetting every call made."""
+        calls = [call for call in self.calls if call[0] in names]
+        self.calls = []
+        return calls
+
+
+class Credentials(object):
+    token = 'token'
+    meta = {'username': u'me', 'discriminator': '0001', 'id': '10', 'default_server_id': None}
+
+    def logout(self):
+        self.logged_out = True
+
+
+def member(user_id, name, roles=()):
+    return {'user': {'id': user_id, 'username': name, 'discriminator': '0001'},
+            'roles': list(roles), 'joined_at': None}
+
+
+def guild(guild_id='1', members=20):
+    """A guild with #general, which everyone can read, #secret_stuff, which
+    only role 1000 can, and a voice channel."""
+    return {
+        'id': guild_id, 'name': 'guild', 'owner_id': '11',
+        'roles': [{'id': guild_id, 'name': '@everyone', 'permissions': 0x400},
+                  {'id': '1000', 'name': 'staff', 'permissions': 0}],
+        'members': [member('10', u'me', ['1000'])] +
+                   [member(str(11 + i), u'user {}'.format(i)) for i in range(members)],
+        'channels': [
+            {'id': guild_id + '01', 'name': u'general', 'type': 'text', 'topic': u'hi',
+             'permission_overwrites': []},
+            {'id': guild_id + '02', 'name': u'Secret Stuff', 'type': 'text',
+             'permission_overwrites': [{'id': guild_id, 'type': 'role', 'allow': 0, 'deny': 0x400},
+                                       {'id': '1000', 'type': 'role', 'allow': 0x400, 'deny': 0}]},
+            {'id': guild_id + '03', 'name': u'General', 'type': 'voice', 'permission_overwrites': []},
+        ],
+    }
+
+
+class SessionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        # cooperative work runs when the test says so, not on the reactor
+        self.scheduled = []
+        cooperator = task.Cooperator(scheduler=self.scheduled.append)
+        self.patch(task, 'cooperate', cooperator.cooperate)
+
+    def run_tasks(self):
+        while self.scheduled:
+            self.scheduled.pop(0)()
+
+    def session(self, token='token', user_id='10'):
+        credentials = Credentials()
+        credentials.token = token
+        credentials.meta = dict(Credentials.meta, id=user_id)
+        user = realm.User(u'me', credentials, reactor=self.clock)
+        user.paste_window = 0
+        client = FakeClient()
+        user.realm = client.realm
+        user.minds.append(client)
+        realm.sessions[token] = user
+        self.addCleanup(realm.sessions.pop, token, None)
+        self.addCleanup(user._drop_guilds)
+        return user, client
+
+    def ready(self, user, *guilds):
+        user.dispatch('READY', {'user': user.credentials.meta, 'session_id': 'abc',
+                                'guilds': [copy.deepcopy(g) for g in guilds]})
+        self.run_tasks()
+
+    def joined(self, client):
+        return sorted(client.realm.guilds)
+
+
+class GuildLoadTests(SessionTestCase):
+    def test_guild_create_while_loading(self):
+        user, client = self.session()
+        user.ready_chunk_size = 5
+        self.ready(user)
+
+        user.dispatch('GUILD_CREATE', guild('2'))
+        # the same guild again, and a message in it, while it still loads
+        user.dispatch('GUILD_CREATE', guild('2'))
+        user.dispatch('MESSAGE_CREATE', {'channel_id': '201', 'id': '1', 'content': u'early',
+                                         'author': {'id': '12', 'username': u'user 1', 'discriminator': '0001'}})
+        self.assertIdentical(user.get_guild('2'), None)
+        self.run_tasks()
+
+        self.assertEqual(shared_guilds._refs['2'], 1)
+        self.assertEqual(client.take('privmsg'), [('privmsg', 'user_1!0001@discord.gg', u'#general', u'early')])
+
+        user.dispatch('GUILD_DELETE', {'id': '2'})
+        self.assertNotIn('2', shared_guilds)
+
+    def test_logging_out_while_loading(self):
+        user, client = self.session()
+        user.ready_chunk_size = 5
+        self.ready(user)
+        user.dispatch('GUILD_CREATE', guild('2'))
+        self.scheduled.pop(0)()
+        user._drop_guilds()
+        self.run_tasks()
+        self.assertIdentical(user.get_guild('2'), None)
+        self.assertNotIn('2', shared_guilds)
+
+
+class GuildDeltaTests(SessionTestCase):
+    def setUp(self):
+        SessionTestCase.setUp(self)
+        self.user, self.client = self.session()
+        self.ready(self.user, guild('1'))
+        self.client.calls = []
+
+    def channels(self, client):
+        return sorted(group.name for group in client.realm.guilds.values())
+
+    def test_ready_joins_readable_channels(self):
+        self.assertEqual(self.channels(self.client), [u'general', u'secret_stuff'])
+
+    def test_channel_rename(self):
+        self.user.dispatch('CHANNEL_UPDATE', {'guild_id': '1', 'id': '101', 'name': u'lobby', 'type': 'text',
+                                              'topic': u'hi', 'permission_overwrites': []})
+        self.run_tasks()
+        calls = self.client.take('userLeft', 'userJoined')
+        # userLeft(group, client, reason), userJoined(group, client)
+        self.assertEqual([(call[0], call[1].name) + call[3:] for call in calls],
+                         [('userLeft', u'general', u'renamed to #lobby'), ('userJoined', u'lobby')])
+        self.assertEqual(self.channels(self.client), [u'lobby', u'secret_stuff'])
+
+    def test_member_add_update_remove(self):
+        self.user.dispatch('GUILD_MEMBER_ADD', dict(member('99', u'new'), guild_id='1'))
+        self.assertEqual(self.client.take('join', 'part'), [('join', 'new!0001@discord.gg', u'#general')])
+
+        # given staff, they can see #secret_stuff too
+        self.user.dispatch('GUILD_MEMBER_UPDATE', dict(member('99', u'new', ['1000']), guild_id='1'))
+        self.assertEqual(self.client.take('join', 'part'), [('join', 'new!0001@discord.gg', u'#Secret_Stuff')])
+
+        self.user.dispatch('GUILD_MEMBER_REMOVE', {'guild_id': '1', 'user': member('99', u'new')['user']})
+        self.assertEqual(sorted(self.client.take('join', 'part')),
+                         [('part', 'new!0001@discord.gg', u'#Secret_Stuff', u'leaving'),
+                          ('part', 'new!0001@discord.gg', u'#general', u'leaving')])
+        self.assertIdentical(self.user.get_guild('1').get_member('99'), None)
+
+    def test_role_delete_resyncs(self):
+        self.user.dispatch('GUILD_ROLE_DELETE', {'guild_id': '1', 'role_id': '1000'})
+        self.run_tasks()
+        self.assertEqual([call[1].name for call in self.client.take('userLeft')], [u'secret_stuff'])
+        self.assertEqual(self.channels(self.client), [u'general'])
+
+    def test_second_session_copy_changes_nothing(self):
+        other, other_client = self.session(token='other', user_id='12')
+        self.ready(other, guild('1'))
+        self.assertIdentical(other.get_guild('1'), self.user.get_guild('1'))
+        other_client.calls = []
+
+        # every session sharing the guild gets its own copy of an event
+        add = dict(member('99', u'new'), guild_id='1')
+        self.user.dispatch('GUILD_MEMBER_ADD', add)
+        other.dispatch('GUILD_MEMBER_ADD', add)
+        rename = {'guild_id': '1', 'id': '101', 'name': u'lobby', 'type': 'text',
+                  'topic': u'hi', 'permission_overwrites': []}
+        self.user.dispatch('CHANNEL_UPDATE', rename)
+        other.dispatch('CHANNEL_UPDATE', rename)
+        self.run_tasks()
+
+        for client in (self.client, other_client):
+            self.assertEqual(client.take('join'), [('join', 'new!0001@discord.gg', u'#general')])
+        self.assertEqual(self.channels(self.client), [u'lobby', u'secret_stuff'])
+        self.assertEqual(self.channels(other_client), [u'lobby'])
+
+
+class SendTests(SessionTestCase):
+    def setUp(self):
+        SessionTestCase.setUp(self)
+        self.patch(spool, 'outbound', spool.Spool())
+        self.patch(realm, 'outbound', spool.outbound)
+        self.user, self.client = self.session()
+        self.ready(self.user, guild('1'))
+
+    def test_failure_is_only_a_notice(self):
+        self.user.rest = ScriptedREST(HTTPError(403, 'missing permissions'))
+        self.client.calls = []
+        results = []
+        self.user.send(self.client.realm.guilds[u'general'], {'text': 'hi'}).addBoth(results.append)
+        self.assertEqual(results, [None])
+        notices = self.client.take('svc_message')
+        self.assertEqual(len(notices), 1)
+        self.assertIn('missing permissions', notices[0][1])
+
+
+class PasteTests(SessionTestCase):
+    def setUp(self):
+        SessionTestCase.setUp(self)
+        self.patch(spool, 'outbound', spool.Spool())
+        self.patch(realm, 'outbound', spool.outbound)
+        self.user, self.client = self.session()
+        self.ready(self.user, guild('1'))
+        self.user.paste_window = 0.3
+        self.user.rest = ScriptedREST(*['{}'] * 10)
+
+    def say(self, channel, *lines):
+        for line in lines:
+            self.user.send(self.client.realm.guilds[channel], {'text': line})
+            self.clock.advance(0.1)
+
+    def posted(self):
+        return [(path.split('/')[2], payload['content']) for path, payload in self.user.rest.posts]
+
+    def test_lines_coalesce(self):
+        self.say(u'general', 'one', 'two', 'three')
+        self.assertEqual(self.posted(), [])
+        self.clock.advance(0.3)
+        self.assertEqual(self.posted(), [('101', u'one\ntwo\nthree')])
+
+    def test_full_message_goes_early(self):
+        line = 'x' * 999
+        self.say(u'general', line, line)
+        # a third line would take it past 2000 characters
+        self.say(u'general', 'three')
+        self.assertEqual(self.posted(), [('101', u'\n'.join([line, line]))])
+        self.clock.advance(0.3)
+        self.assertEqual(self.posted()[1:], [('101', u'three')])
+
+    def test_other_channel_flushes(self):
+        self.say(u'general', 'one', 'two')
+        self.say(u'secret_stuff', 'elsewhere')
+        self.assertEqual(self.posted(), [('101', u'one\ntwo')])
+        self.clock.advance(0.3)
+        self.assertEqual(self.posted()[1:], [('102', u'elsewhere')])
+
+
+class DetachTests(SessionTestCase):
+    def setUp(self):
+        SessionTestCase.setUp(self)
+        self.user, self.client = self.session()
+        self.ready(self.user, guild('1'))
+        self.user.detach_timeout = 60
+
+    def message(self, n):
+        self.user.dispatch('MESSAGE_CREATE', {
+            'channel_id': '101', 'id': str(n), 'content': u'line {}'.format(n),
+            'author': {'id': '12', 'username': u'user 1', 'discriminator': '0001'}})
+
+    def logged_out(self):
+        return getattr(self.user.credentials, 'logged_out', False)
+
+    def test_logs_out_at_once_without_timeout(self):
+        self.user.detach_timeout = 0
+        self.user.detach(self.client, u'bye')
+        self.assertTrue(self.logged_out())
+        self.assertNotIn('token', realm.sessions)
+        self.assertNotIn('1', shared_guilds)
+
+    def test_expires(self):
+        self.user.detach(self.client, u'bye')
+        self.clock.advance(59)
+        self.assertFalse(self.logged_out())
+        self.assertIdentical(realm.sessions['token'], self.user)
+        self.clock.advance(1)
+        self.assertTrue(self.logged_out())
+        self.assertNotIn('token', realm.sessions)
+        self.assertNotIn('1', shared_guilds)
+        self.assertEqual(len(self.user.backlog), 0)
+
+    def test_backlog_overflow(self):
+        self.user.backlog_size = 3
+        self.user.detach(self.client, u'bye')
+        for n in range(5):
+            self.message(n)
+        self.assertEqual([line for received, sender, channel, line in self.user.backlog],
+                         [u'line 2', u'line 3', u'line 4'])
+        self.assertEqual(self.user._backlog_dropped, 2)
+
+    def test_reattach_replays(self):
+        self.user.backlog_size = 3
+        self.user.detach(self.client, u'bye')
+        self.clock.advance(30)
+        for n in range(5):
+            self.message(n)
+
+        client = FakeClient()
+        self.user.attach(client)
+        self.run_tasks()
+        self.assertEqual(sorted(client.realm.guilds), [u'general', u'secret_stuff'])
+        calls = client.take('svc_message', 'privmsg')
+        self.assertEqual(calls[:2], [
+            ('svc_message', 'Attached to your existing discord session.'),
+            ('svc_message', '2 older messages did not fit in the backlog.')])
+        # with the time they came in up front, as [HH:MM:SS]
+        self.assertEqual([(call[0], call[1], call[2], call[3][11:]) for call in calls[2:]],
+                         [('privmsg', 'user_1!0001@discord.gg', u'#general', u'line {}'.format(n))
+                          for n in (2, 3, 4)])
+        self.assertEqual(len(self.user.backlog), 0)
+
+        # live again, and the expiry is off
+        self.message(5)
+        self.assertEqual(len(client.take('privmsg')), 1)
+        self.clock.advance(60)
+        self.assertFalse(self.logged_out())
@@ -0,0 +1,192 @@
+import json
+
+from twisted.internet import defer, task
+from twisted.trial import unittest
+from twisted.web.client import ResponseDone
+from twisted.web.http_headers import Headers
+from twisted.python import failure
+
+import chord
+import rest
+
+
+class FakeResponse(object):
+    phrase = 'OK'
+
+    def __init__(self, code, body, headers):
+        self.code = code
+        self.body = body
+        self.headers = Headers(dict((name, [value]) for name, value in headers.items()))
+
+    def deliverBody(self, protocol):
+        protocol.dataReceived(self.body)
+        protocol.connectionLost(failure.Failure(ResponseDone()))
+
+
+class FakeAgent(object):
+    """Holds on to requests until the test answers them."""
+    def __init__(self):
+        self.requests = []
+
+    def request(self, method, uri, headers, body):
+        d = defer.Deferred()
+        self.requests.append((method, uri, d))
+        return d
+
+    def respond(self, code=200, body='{}', **headers):
+        method, uri, d = self.requests.pop(0)
+        d.callback(FakeResponse(code, body, dict((name.replace('_', '-'), value)
+                                                 for name, value in headers.items())))
+        return uri
+
+
+class RESTClientTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.client = rest.RESTClient('token', self.clock)
+        self.client.pool = rest.ConnectionPool(self.clock)
+        self.client.agent = self.agent = FakeAgent()
+
+    def post(self, path, n=1):
+        return [self.client.post(path, {'n': i}) for i in range(n)]
+
+    def test_one_request_until_limits_are_known(self):
+        self.post('/channels/1111111111111111/messages', 3)
+        self.assertEqual(len(self.agent.requests), 1)
+        self.agent.respond(**{'X_RateLimit_Remaining': '4', 'X_RateLimit_Reset_After': '1'})
+        self.assertEqual(len(self.agent.requests), 2)
+
+    def test_waits_for_bucket_reset(self):
+        results = []
+        for d in self.post('/channels/1111111111111111/messages', 3):
+            d.addCallback(results.append)
+        self.agent.respond(body='"first"', **{'X_RateLimit_Remaining': '1', 'X_RateLimit_Reset_After': '2'})
+        self.agent.respond(body='"second"', **{'X_RateLimit_Remaining': '0', 'X_RateLimit_Reset_After': '2'})
+        self.assertEqual(self.agent.requests, [])
+        self.clock.advance(1.9)
+        self.assertEqual(self.agent.requests, [])
+        self.clock.advance(0.1)
+        self.agent.respond(body='"third"')
+        self.assertEqual(results, ['"first"', '"second"', '"third"'])
+        self.assertEqual(self.client.rate_limited, 0)
+
+    def test_buckets_are_per_route(self):
+        self.post('/channels/1111111111111111/messages')
+        self.post('/channels/2222222222222222/messages')
+        self.post('/channels/1111111111111111/messages/3333333333333333')
+        self.post('/channels/1111111111111111/messages/4444444444444444')
+        self.assertEqual(len(self.agent.requests), 3)
+        self.assertEqual(sorted(self.client.buckets), [
+            'POST /channels/1111111111111111/messages',
+            'POST /channels/1111111111111111/messages/{id}',
+            'POST /channels/2222222222222222/messages',
+        ])
+
+    def test_429_is_retried(self):
+        results = []
+        self.post('/channels/1111111111111111/messages')[0].addCallback(results.append)
+        self.agent.respond(429, json.dumps({'retry_after': 1500}))
+        self.assertEqual(self.agent.requests, [])
+        self.clock.advance(1.5)
+        self.agent.respond(body='"sent"')
+        self.assertEqual(results, ['"sent"'])
+        self.assertEqual(self.client.rate_limited, 1)
+
+    def test_global_429_holds_every_bucket(self):
+        self.post('/channels/1111111111111111/messages')
+        self.agent.respond(429, json.dumps({'retry_after': 1000}), X_RateLimit_Global='true')
+        self.post('/channels/2222222222222222/messages')
+        self.assertEqual(self.agent.requests, [])
+        self.clock.advance(1)
+        self.assertEqual(len(self.agent.requests), 2)
+
+    def test_long_429_fails(self):
+        d = self.post('/users/@me')[0]
+        self.agent.respond(429, json.dumps({'retry_after': 3600 * 1000}))
+        self.failureResultOf(d, chord.errors.RateLimitError)
+
+    def test_errors(self):
+        unauthorized, missing = self.post('/users/@me'), self.post('/channels/1111111111111111/messages')
+        self.agent.respond(401, 'nope')
+        self.agent.respond(404, 'gone')
+        self.failureResultOf(unauthorized[0], chord.errors.LoginError)
+        self.assertEqual(self.failureResultOf(missing[0], rest.HTTPError).value.code, 404)
+
+    def test_connections_are_capped(self):
+        self.client.pool.set_max_connections(2)
+        for i in range(4):
+            self.post('/channels/{}/messages'.format(1111111111111111 + i))
+        self.assertEqual(len(self.agent.requests), 2)
+        self.agent.respond()
+        self.assertEqual(len(self.agent.requests), 2)
+        self.agent.respond()
+        self.agent.respond()
+        self.agent.respond()
+        self.assertEqual(self.agent.requests, [])
+
+
+class RateLimitedAgent(object):
+    """Discord, as far as rate limits go: every route takes limit requests
+    per window seconds and answers the rest with a 429. Responses take
+    latency seconds to come back."""
+    def __init__(self, clock, limit=5, window=5.0, latency=0.1):
+        self.clock = clock
+        self.limit = limit
+        self.window = window
+        self.latency = latency
+        self.routes = {}
+        self.answered = []
+
+    def request(self, method, uri, headers, body):
+        path = uri[len(rest.API):]
+        route = method + ' ' + rest._minor_ids.sub('{id}', path)
+        now = self.clock.seconds()
+        remaining, reset_at = self.routes.get(route, (0, 0.0))
+        if now >= reset_at:
+            remaining, reset_at = self.limit, now + self.window
+        if remaining == 0:
+            code, body = 429, json.dumps({'retry_after': int((reset_at - now) * 1000), 'global': False})
+        else:
+            remaining -= 1
+            code, body = 200, '{}'
+        self.routes[route] = remaining, reset_at
+        self.answered.append((now, code, path))
+        response = FakeResponse(code, body, {'X-RateLimit-Limit': str(self.limit),
+                                             'X-RateLimit-Remaining': str(remaining),
+                                             'X-RateLimit-Reset-After': '{:.3f}'.format(reset_at - now)})
+        d = defer.Deferred()
+        self.clock.callLater(self.latency, d.callback, response)
+        return d
+
+
+class RateLimitTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.agent = RateLimitedAgent(self.clock)
+        self.client = rest.RESTClient('token', self.clock)
+        self.client.pool = rest.ConnectionPool(self.clock)
+        self.client.agent = self.agent
+
+    def test_agent_limits(self):
+        for i in range(6):
+            self.agent.request('POST', rest.API + '/channels/1111111111111111/messages', None, None)
+        self.agent.request('POST', rest.API + '/channels/2222222222222222/messages', None, None)
+        self.assertEqual([code for now, code, path in self.agent.answered], [200] * 5 + [429, 200])
+
+    def test_paste_burst(self):
+        results = []
+        # a paste that didn't get coalesced, a line a message, with some
+        # talk elsewhere meanwhile
+        for i in range(23):
+            d = self.client.post('/channels/1111111111111111/messages', {'content': 'line {}'.format(i)})
+            d.addCallback(lambda body, i=i: results.append(i))
+        for i in range(3):
+            self.client.post('/channels/2222222222222222/messages', {'content': 'hi'})
+        self.clock.pump([0.05] * 600)
+
+        self.assertEqual(results, range(23))
+        self.assertEqual([code for now, code, path in self.agent.answered], [200] * 26)
+        self.assertEqual(self.client.rate_limited, 0)
+        self.assertEqual(self.client.queue_depth, 0)
+        # 5 messages every 5 seconds, and not much more than that
+        self.assertLess(self.agent.answered[-1][0], 25.5)
@@ -0,0 +1,202 @@
+import json
+import os
+
+from twisted.internet import defer, task
+from twisted.python import failure
+from twisted.trial import unittest
+
+import chord
+import realm
+import spool
+from rest import HTTPError
+
+
+class ScriptedREST(object):
+    """Answers each post with the next of results: an exception fails it,
+    None leaves it for the test to fire, anything else succeeds."""
+    def __init__(self, *results):
+        self.results = list(results)
+        self.posts = []
+        self.waiting = []
+
+    def post(self, path, payload):
+        self.posts.append((path, payload))
+        result = self.results.pop(0)
+        if result is None:
+            d = defer.Deferred()
+            self.waiting.append(d)
+            return d
+        if isinstance(result, Exception):
+            return defer.fail(result)
+        return defer.succeed(result)
+
+
+class FakeChannel(object):
+    id = '5'
+    irc_name = 'general'
+
+
+class FakeSession(object):
+    id = '10'
+
+    def __init__(self, rest):
+        self.rest = rest
+        self.reactor = task.Clock()
+        self.notices = []
+        self._pending_sends = realm.PendingSends()
+
+    def get_channel(self, id):
+        return FakeChannel()
+
+    def svc_message(self, message):
+        self.notices.append(message)
+
+
+class SpoolTests(unittest.TestCase):
+    def setUp(self):
+        self.spool = spool.Spool()
+
+    def send(self, session, nonce=42, **kw):
+        results = []
+        d = self.spool.send(session, '5', u'hello', nonce, **kw)
+        d.addBoth(results.append)
+        return results
+
+    def test_retries_with_backoff(self):
+        session = FakeSession(ScriptedREST(HTTPError(502, 'bad gateway'), IOError('reset'), '{"id": "1"}'))
+        results = self.send(session)
+        self.assertEqual(len(session.rest.posts), 1)
+        session.reactor.advance(1.5)
+        self.assertEqual(len(session.rest.posts), 2)
+        session.reactor.advance(3.0)
+        self.assertEqual(len(session.rest.posts), 3)
+        self.assertEqual(results, ['{"id": "1"}'])
+        self.assertEqual(set(payload['nonce'] for path, payload in session.rest.posts), set([u'42']))
+        self.assertEqual((len(self.spool), self.spool.retried), (0, 2))
+
+    def test_gives_up_on_client_errors(self):
+        session = FakeSession(ScriptedREST(HTTPError(403, 'missing permissions')))
+        results = self.send(session)
+        self.assertIsInstance(results[0], failure.Failure)
+        self.assertEqual(len(session.notices), 1)
+        self.assertIn('#general', session.notices[0])
+        self.assertEqual(len(self.spool), 0)
+
+    def test_gives_up_on_bad_token(self):
+        session = FakeSession(ScriptedREST(chord.errors.LoginError('401')))
+        results = self.send(session)
+        results[0].trap(chord.errors.LoginError)
+
+    def test_gives_up_after_max_attempts(self):
+        errors = [HTTPError(500, 'oops') for i in range(self.spool.max_attempts)]
+        session = FakeSession(ScriptedREST(*errors))
+        results = self.send(session)
+        session.reactor.pump([60] * self.spool.max_attempts)
+        self.assertEqual(len(session.rest.posts), self.spool.max_attempts)
+        results[0].trap(HTTPError)
+        self.assertEqual(self.spool.failed, 1)
+
+    def test_echo_before_response(self):
+        session = FakeSession(ScriptedREST(None))
+        accepted = []
+        results = self.send(session, accepted=accepted.append)
+        self.spool.delivered(u'42')
+        self.assertEqual(results, [None])
+        self.assertEqual(accepted, [])
+        # settles nothing a second time, and still counts as accepted
+        session.rest.waiting[0].callback('{"id": "1"}')
+        self.assertEqual(results, [None])
+        self.assertEqual(accepted, ['{"id": "1"}'])
+
+    def test_echo_before_error(self):
+        session = FakeSession(ScriptedREST(None))
+        results = self.send(session)
+        self.spool.delivered(u'42')
+        session.rest.waiting[0].errback(IOError('reset'))
+        session.reactor.advance(60)
+        self.assertEqual(len(session.rest.posts), 1)
+        self.assertEqual(results, [None])
+        self.assertEqual(session.notices, [])
+
+    def test_kept_on_disk(self):
+        path = self.mktemp()
+        self.spool.open(path)
+        session = FakeSession(ScriptedREST(None, '{}'))
+        self.send(session, 1)
+        self.send(session, 2)
+        with open(path, 'a') as f:
+            f.write('{"nonce": "3", "us') # cut short by a crash
+
+        restarted = spool.Spool()
+        restarted.open(path)
+        self.assertEqual(restarted.pending.keys(), [u'1'])
+        with open(path) as f:
+            self.assertEqual(len(f.readlines()), 1)
+
+        session = FakeSession(ScriptedREST('{}'))
+        restarted.resume(session)
+        self.assertEqual(session.rest.posts, [('/channels/5/messages', {'content': u'hello', 'nonce': u'1'})])
+        self.assertEqual(len(restarted), 0)
+        self.assertIsNot(session._pending_sends.pop(u'1'), None)
+
+    def test_file_emptied_when_nothing_pending(self):
+        path = self.mktemp()
+        self.spool.open(path)
+        session = FakeSession(ScriptedREST(None, '{}'))
+        self.send(session, 1)
+        self.send(session, 2)
+        self.assertNotEqual(os.path.getsize(path), 0)
+        session.rest.waiting[0].callback('{}')
+        self.assertEqual(os.path.getsize(path), 0)
+
+        # and kept appending to
+        session.rest.results.append(None)
+        self.send(session, 3)
+        self.spool.open(path)
+        self.assertEqual(self.spool.pending.keys(), [u'3'])
+
+    def test_file_compacted(self):
+        path = self.mktemp()
+        self.spool.open(path)
+        self.spool.compact_size = 500
+        session = FakeSession(ScriptedREST(*([None] + ['{}'] * 20)))
+        self.send(session, 0)
+        for nonce in range(1, 21):
+            self.send(session, nonce)
+        # rewritten once it got past compact_size, with just the one
+        # message still pending by now
+        self.assertLess(os.path.getsize(path), 500)
+        with open(path) as f:
+            self.assertEqual(json.loads(f.readline())['nonce'], u'0')
+
+
+class SendLatencyTests(unittest.TestCase):
+    def setUp(self):
+        self.patch(spool, 'outbound', spool.Spool())
+        self.patch(realm, 'outbound', spool.outbound)
+        self.clock = task.Clock()
+        self.user = realm.User(u'me', reactor=self.clock)
+        self.user.rest = ScriptedREST(None)
+
+    def echo(self):
+        nonce = self.user.rest.posts[-1][1]['nonce']
+        self.user.on_message_create({'channel_id': '5', 'nonce': nonce})
+
+    def test_echo_after_response(self):
+        self.user._post_message(FakeChannel(), u'hello')
+        self.clock.advance(0.1)
+        self.user.rest.waiting[0].callback('{}')
+        self.clock.advance(0.2)
+        self.echo()
+        self.assertEqual(self.user.send_latency['accepted'].max, 0.1)
+        self.assertAlmostEqual(self.user.channel_latency['5']['echoed'].max, 0.3)
+        self.assertEqual(len(self.user._pending_sends), 0)
+
+    def test_echo_before_response(self):
+        self.user._post_message(FakeChannel(), u'hello')
+        self.clock.advance(0.1)
+        self.echo()
+        self.clock.advance(0.2)
+        self.user.rest.waiting[0].callback('{}')
+        self.assertEqual(self.user.send_latency['echoed'].max, 0.1)
+        self.assertAlmostEqual(self.user.send_latency['accepted'].max, 0.3)